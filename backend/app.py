@@ -1,37 +1,151 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, redirect, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 import os
 import tempfile
-from main import AnimationGenerator
+from jobs import CANCELLED, QueueFullError, SUCCEEDED, job_manager_from_env
+from partial_cache import get_partial_cache
+from tts import get_phrase_cache
+import metrics
 from flask_cors import CORS
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Job-Id', 'X-Job-Status-Url', 'Accept-Ranges', 'Content-Range', 'ETag'])
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB limit
 app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
 
+# Background worker pool for /api/jobs (JOB_WORKERS / JOB_QUEUE_DEPTH)
+job_manager = job_manager_from_env(work_root=app.config['UPLOAD_FOLDER'])
+result_cache = job_manager.result_cache
+
+metrics.Gauge('text2mathvideo_jobs_in_flight', 'Pipeline runs queued or running',
+              lambda: job_manager.stats()['flights'])
+
+def job_response(job):
+    data = job.to_dict()
+    data['status_url'] = f"/api/jobs/{job.id}"
+    data['result_url'] = f"/api/jobs/{job.id}/result" if job.status == SUCCEEDED else None
+    data['preview_url'] = f"/api/jobs/{job.id}/preview" if job.preview and job.status != CANCELLED else None
+    return data
+
+def submit_job(data):
+    """Submit a request body's prompt with its optional quality tiers and delivery policy"""
+    return job_manager.submit(
+        data['prompt'],
+        quality=data.get('quality'),
+        policy=data.get('policy'),
+        preview_quality=data.get('preview_quality'),
+    )
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    data = request.get_json(silent=True) or {}
+    if not data.get('prompt'):
+        return jsonify({'error': 'Prompt is required'}), 400
+    
+    try:
+        job = submit_job(data)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(job_response(job)), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': f'Job already {job.status}'}), 409
+    return jsonify(job_response(job))
+
+def send_video(path, download_name):
+    """Stream an MP4 artifact inline, or as a download with ?download=1.
+
+    Conditional responses give players Range requests (206 Partial Content),
+    an ETag and If-None-Match / If-Modified-Since / If-Range handling, so
+    they can start playing and seek without fetching the whole file.
+    """
+    return send_file(
+        path,
+        mimetype='video/mp4',
+        as_attachment=request.args.get('download') == '1',
+        download_name=download_name,
+        conditional=True,
+        etag=True
+    )
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status != SUCCEEDED:
+        return jsonify({'error': f'Job is {job.status}'}), 409
+    return send_video(job.result, 'animation.mp4')
+
+@app.route('/api/jobs/<job_id>/preview', methods=['GET'])
+def get_job_preview(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.preview or job.status == CANCELLED:
+        return jsonify({'error': 'No preview available'}), 409
+    return send_video(job.preview, 'animation_preview.mp4')
+
 @app.route('/api/generate', methods=['POST'])
 def generate_animation():
     if 'prompt' not in request.json or not request.json['prompt']:
         return jsonify({'error': 'Prompt is required'}), 400
     
     try:
-        prompt = request.json['prompt']
-        generator = AnimationGenerator()
-        result = generator.process(prompt)
-        
-        if not result:
-            return jsonify({'error': 'Failed to generate animation'}), 500
-            
-        return send_file(
-            result,
-            mimetype='video/mp4',
-            as_attachment=True,
-            download_name='animation.mp4'
-        )
+        # Runs through the job manager so identical concurrent requests share one run
+        job = submit_job(request.json)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Finished videos are served from their artifact URL (303 See Other), where
+    # they can be streamed with Range requests until the job's retention ends
+    headers = {'X-Job-Id': job.id, 'X-Job-Status-Url': f"/api/jobs/{job.id}"}
+    try:
+        if job.policy == 'progressive':
+            # Answer with the preview; the high quality video replaces it at
+            # the job's result URL once the background re-render finishes
+            job.preview_ready.wait()
+            if job.preview and job.status != CANCELLED:
+                return redirect(f"/api/jobs/{job.id}/preview", code=303), headers
+        job.done.wait()
+        if job.status != SUCCEEDED:
+            job_manager.discard(job.id)
+            return jsonify({'error': job.error or 'Failed to generate animation'}), 500
+        return redirect(f"/api/jobs/{job.id}/result", code=303), headers
     except Exception as e:
+        job_manager.discard(job.id)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/stats')
+def cache_stats():
+    partial_cache = get_partial_cache()
+    stats = dict(result_cache.stats(), enabled=True) if result_cache else {'enabled': False}
+    stats['partial_movies'] = dict(partial_cache.stats(), enabled=True) if partial_cache else {'enabled': False}
+    phrase_cache = get_phrase_cache()
+    stats['tts_phrases'] = dict(phrase_cache.stats(), enabled=True) if phrase_cache else {'enabled': False}
+    stats['jobs'] = job_manager.stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy'})
@@ -0,0 +1,268 @@
+"""Offline end-to-end benchmark for the generation pipeline.
+
+Runs AnimationGenerator on a corpus of recorded scripts and explanations with
+no network access: a stub LLM replays the corpus and every phrase is spoken
+by a local tone engine of matching length instead of gTTS. Manim, LaTeX and ffmpeg run
+for real, so render, sync and voiceover regressions show up in the numbers.
+
+    python benchmark.py --concurrency 1,2,4 --jobs 8 --output bench.json --baseline bench_baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llm import StubLLMClient
+from main import AnimationGenerator
+from metrics import peak_rss_bytes, run as run_measured, write_bytes
+from tts import TTSEngine
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_corpus.jsonl")
+
+# Typical gTTS pace, used to size the stand-in narration
+WORDS_PER_SECOND = 2.5
+
+# Metrics where a bigger number is better; everything else is a cost
+HIGHER_IS_BETTER = ('jobs_per_hour',)
+
+
+class ToneEngine(TTSEngine):
+    """Stand-in for gTTS: an MP3 tone as long as the phrase would take to speak"""
+
+    name = "tone"
+
+    def __init__(self, voice="220"):
+        super().__init__(voice)
+
+    def synthesize(self, text, rate=1.0, report=None):
+        duration = max(len(text.split()) / WORDS_PER_SECOND, 0.5)
+        return run_measured('ffmpeg_tts_standin', [
+            'ffmpeg', '-hide_banner',
+            '-f', 'lavfi', '-i', f'sine=frequency={self.voice}:sample_rate=24000:duration={duration:.2f}',
+            '-f', 'mp3', 'pipe:1'
+        ], capture_output=True, check=True, report=report).stdout
+
+
+def load_corpus(path, prompts_path=None):
+    """Corpus entries ({prompt, code, explanation}), optionally re-using their scripts for other prompts.
+
+    ``prompts_path`` may point at any JSONL file whose lines carry a ``prompt``
+    or a ``title`` (such as requests.jsonl); those prompts are assigned the
+    corpus scripts round robin.
+    """
+    with open(path) as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    if not corpus:
+        raise ValueError(f"Benchmark corpus {path} is empty")
+    if not prompts_path:
+        return corpus
+
+    with open(prompts_path) as f:
+        prompts = [json.loads(line) for line in f if line.strip()]
+    entries = []
+    for i, item in enumerate(prompts):
+        recorded = corpus[i % len(corpus)]
+        entries.append(dict(recorded, prompt=item.get('prompt') or item.get('title')))
+    return entries
+
+
+def disk_written_bytes(results, own_bytes):
+    """Bytes a level's jobs wrote to storage, or None off Linux.
+
+    ``own_bytes`` is what this process itself wrote during the level; every
+    subprocess, including render workers (children of the fork server, so
+    invisible from here), reports its own writes in the job report.
+    Writes to tmpfs never reach storage and are not counted.
+    """
+    if own_bytes is None:
+        return None
+    return own_bytes + sum(entry.get('write_bytes') or 0
+                           for r in results for entry in r['report']['subprocesses'])
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(int(round(q * (len(values) - 1))), len(values) - 1)]
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {
+        'mean': round(sum(values) / len(values), 3),
+        'p50': round(percentile(values, 0.5), 3),
+        'p95': round(percentile(values, 0.95), 3),
+        'max': round(max(values), 3),
+    }
+
+
+def run_job(entry, work_root, quality):
+    """Generate one video and return its measurements; the files are thrown away"""
+    work_dir = tempfile.mkdtemp(dir=work_root)
+    llm = StubLLMClient(scripts=[entry['code']], explanation=entry['explanation'])
+    generator = AnimationGenerator(work_dir=work_dir, quality=quality, llm=llm, tts_engine=ToneEngine())
+    started = time.perf_counter()
+    try:
+        output = generator.process(entry['prompt'], output_path=os.path.join(work_dir, "final_output.mp4"))
+    finally:
+        seconds = time.perf_counter() - started
+    report = generator.report.to_dict()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'prompt': entry['prompt'],
+        'ok': bool(output),
+        'error': generator.error,
+        'seconds': round(seconds, 3),
+        'stages': generator.stage_timings,
+        'report': report,
+    }
+
+
+def run_level(entries, concurrency, jobs, work_root, quality):
+    """Run ``jobs`` jobs with ``concurrency`` of them at a time"""
+    batch = [entries[i % len(entries)] for i in range(jobs)]
+    written_before = write_bytes()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda entry: run_job(entry, work_root, quality), batch))
+    wall = time.perf_counter() - started
+    written_after = write_bytes()
+
+    succeeded = [r for r in results if r['ok']]
+    stage_names = sorted({name for r in succeeded for name in r['stages']})
+    commands = sorted({p['command'] for r in succeeded for p in r['report']['subprocesses']})
+    child_peaks = [p['peak_rss_bytes'] for r in results for p in r['report']['subprocesses']
+                   if p.get('peak_rss_bytes')]
+    return {
+        'concurrency': concurrency,
+        'jobs': jobs,
+        'succeeded': len(succeeded),
+        'failures': [{'prompt': r['prompt'], 'error': r['error']} for r in results if not r['ok']],
+        'wall_seconds': round(wall, 3),
+        'jobs_per_hour': round(len(succeeded) / wall * 3600, 2) if wall else None,
+        'job_seconds': summarize([r['seconds'] for r in succeeded]),
+        'stages': {name: summarize([r['stages'][name]['duration'] for r in succeeded if name in r['stages']])
+                   for name in stage_names},
+        'subprocesses': {command: summarize([p['seconds'] for r in succeeded for p in r['report']['subprocesses']
+                                             if p['command'] == command])
+                         for command in commands},
+        'render_fps': summarize([r['report'].get('render_fps') for r in succeeded]),
+        'child_peak_rss_bytes': max(child_peaks) if child_peaks else None,
+        'disk_written_bytes': disk_written_bytes(
+            results, written_after - written_before if written_before is not None else None),
+    }
+
+
+def flatten(results):
+    """The comparable numbers of a benchmark run, keyed by a stable dotted name"""
+    flat = {'peak_rss_bytes': results.get('peak_rss_bytes')}
+    for level in results['levels']:
+        prefix = f"c{level['concurrency']}"
+        flat[f"{prefix}.jobs_per_hour"] = level['jobs_per_hour']
+        flat[f"{prefix}.child_peak_rss_bytes"] = level['child_peak_rss_bytes']
+        flat[f"{prefix}.disk_written_bytes"] = level['disk_written_bytes']
+        for group in ('stages', 'subprocesses'):
+            for name, stats in level[group].items():
+                if stats:
+                    flat[f"{prefix}.{group}.{name}.p50"] = stats['p50']
+    return {name: value for name, value in flat.items() if value is not None}
+
+
+def compare(results, baseline, threshold):
+    """Relative change of every shared metric, flagging moves past ``threshold`` in the wrong direction"""
+    current, previous = flatten(results), flatten(baseline)
+    comparison = {}
+    for name in sorted(set(current) & set(previous)):
+        if not previous[name]:
+            continue
+        change = current[name] / previous[name] - 1
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        comparison[name] = {
+            'baseline': previous[name],
+            'current': current[name],
+            'change': round(change, 3),
+            'regression': worse > threshold,
+        }
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the generation pipeline")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="JSONL of {prompt, code, explanation}")
+    parser.add_argument('--prompts', help="optional JSONL of prompts (or titles) to replay the corpus scripts under")
+    parser.add_argument('--concurrency', default="1,2", help="comma separated concurrency levels")
+    parser.add_argument('--jobs', type=int, default=4, help="jobs run at every concurrency level")
+    parser.add_argument('--quality', default="low", choices=['low', 'medium', 'high'])
+    parser.add_argument('--partial-cache', action='store_true',
+                        help="keep the shared partial movie cache on (off by default so every render is cold)")
+    parser.add_argument('--phrase-cache', action='store_true',
+                        help="keep the TTS phrase cache on (off by default so every phrase is synthesized)")
+    parser.add_argument('--output', help="write the results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="relative change counted as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with status 1 on regressions")
+    args = parser.parse_args(argv)
+
+    if not args.partial_cache:
+        os.environ["PARTIAL_CACHE_MAX_BYTES"] = "0"
+    if not args.phrase_cache:
+        os.environ["TTS_CACHE_MAX_BYTES"] = "0"
+
+    entries = load_corpus(args.corpus, args.prompts)
+    levels = [int(level) for level in args.concurrency.split(',')]
+    work_root = tempfile.mkdtemp(prefix="text2mathvideo_bench_")
+    try:
+        results = {
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quality': args.quality,
+            'corpus': os.path.abspath(args.corpus),
+            'levels': [],
+        }
+        for concurrency in levels:
+            print(f"Benchmarking {args.jobs} jobs at concurrency {concurrency}...", file=sys.stderr)
+            results['levels'].append(run_level(entries, concurrency, args.jobs, work_root, args.quality))
+        results['peak_rss_bytes'] = peak_rss_bytes()
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            results['comparison'] = compare(results, json.load(f), args.threshold)
+        regressions = [name for name, item in results['comparison'].items() if item['regression']]
+        results['regressions'] = regressions
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline and args.baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text + '\n')
+
+    for level in results['levels']:
+        print(f"concurrency {level['concurrency']}: {level['succeeded']}/{level['jobs']} ok, "
+              f"{level['jobs_per_hour']} jobs/hour", file=sys.stderr)
+    for name in regressions:
+        item = results['comparison'][name]
+        print(f"REGRESSION {name}: {item['baseline']} -> {item['current']} ({item['change']:+.1%})",
+              file=sys.stderr)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+def normalize_prompt(prompt):
+    """Canonical form of a prompt so trivial variations share a cache entry"""
+    return ' '.join(prompt.lower().split()).rstrip('.!?')
+
+
+def cache_key(prompt, model, quality, version):
+    """Content address of a generation request"""
+    payload = json.dumps({
+        'prompt': normalize_prompt(prompt),
+        'model': model,
+        'quality': quality,
+        'version': version,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(src, dest):
+    """Hard-link src to dest when possible, falling back to a copy"""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+    return dest
+
+
+def list_files(root, suffix=''):
+    """List (last_use, size, path) for every file under root whose name ends with suffix"""
+    result = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            result.append((stat.st_mtime, stat.st_size, path))
+    return result
+
+
+class LRUDirectory:
+    """Byte budget of an on-disk cache, evicting least recently used items first.
+
+    ``scan`` lists (last_use, size, path) for every item and ``remove``
+    deletes one. The total size is kept as a running count, so storing an
+    item only rescans the cache once the count goes over budget, or once it
+    is ``rescan_seconds`` old since other processes may share the directory.
+    Eviction goes down to ``low_water`` of the budget so a full cache is not
+    rescanned on every store.
+    """
+
+    def __init__(self, max_bytes, scan, remove, rescan_seconds=60, low_water=0.9):
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.scan = scan
+        self.remove = remove
+        self.rescan_seconds = rescan_seconds
+        self.total = None
+        self.scanned_at = 0
+        self.lock = threading.Lock()
+
+    def added(self, size):
+        """Account for a newly stored item, evicting if the cache went over budget"""
+        with self.lock:
+            if self.total is None or time.monotonic() - self.scanned_at > self.rescan_seconds:
+                self._evict()
+                return
+            self.total += size
+            if self.total > self.max_bytes:
+                self._evict()
+
+    def evict(self):
+        """Drop least recently used items until the cache fits its byte budget"""
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        items = sorted(self.scan())
+        total = sum(size for _, size, _ in items)
+        target = self.max_bytes * self.low_water if total > self.max_bytes else self.max_bytes
+        for _, size, path in items:
+            if total <= target:
+                break
+            try:
+                self.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.total = total
+        self.scanned_at = time.monotonic()
+
+    def usage(self):
+        """(items, bytes) currently in the cache"""
+        items = self.scan()
+        return len(items), sum(size for _, size, _ in items)
+
+
+class ResultCache:
+    """On-disk cache of finished videos and their intermediate artifacts.
+
+    Entries live in ``<root>/<key>/`` and are evicted least recently used
+    first once the total size goes over ``max_bytes``.
+    """
+
+    VIDEO = "video.mp4"
+    CODE = "code.py"
+    EXPLANATION = "explanation.txt"
+    VOICEOVER = "voiceover.mp3"
+    META = "meta.json"
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.store = LRUDirectory(max_bytes, self.entries, lambda path: shutil.rmtree(path, ignore_errors=True))
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return the paths of a cached entry, or None on a miss"""
+        entry_dir = self.entry_dir(key)
+        video = os.path.join(entry_dir, self.VIDEO)
+        meta = os.path.join(entry_dir, self.META)
+        with self.lock:
+            if not (os.path.exists(video) and os.path.exists(meta)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            # The metadata mtime doubles as the LRU access time
+            os.utime(meta)
+        entry = {'key': key, 'video': video}
+        for name, filename in [('code', self.CODE), ('explanation', self.EXPLANATION),
+                               ('voiceover', self.VOICEOVER)]:
+            path = os.path.join(entry_dir, filename)
+            entry[name] = path if os.path.exists(path) else None
+        return entry
+
+    def put(self, key, video_file, code=None, explanation=None, voiceover_file=None, metadata=None):
+        """Store a finished video and its artifacts under the given key"""
+        if self.max_bytes <= 0:
+            return None
+        tmp_dir = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            link_or_copy(video_file, os.path.join(tmp_dir, self.VIDEO))
+            if voiceover_file and os.path.exists(voiceover_file):
+                link_or_copy(voiceover_file, os.path.join(tmp_dir, self.VOICEOVER))
+            if code is not None:
+                with open(os.path.join(tmp_dir, self.CODE), 'w') as f:
+                    f.write(code)
+            if explanation is not None:
+                with open(os.path.join(tmp_dir, self.EXPLANATION), 'w') as f:
+                    f.write(explanation)
+            with open(os.path.join(tmp_dir, self.META), 'w') as f:
+                json.dump(dict(metadata or {}, key=key, created_at=time.time()), f)
+            size = sum(size for _, size, _ in list_files(tmp_dir))
+            # Publish atomically; if another worker got there first keep theirs
+            try:
+                os.rename(tmp_dir, self.entry_dir(key))
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                size = 0
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.store.added(size)
+        return self.entry_dir(key)
+
+    def entries(self):
+        """List (last_access, size, path) for every complete entry"""
+        result = []
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            meta = os.path.join(entry_dir, self.META)
+            if name.startswith('.') or not os.path.exists(meta):
+                continue
+            size = sum(size for _, size, _ in list_files(entry_dir))
+            try:
+                result.append((os.path.getmtime(meta), size, entry_dir))
+            except OSError:
+                continue
+        return result
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits its byte budget"""
+        self.store.evict()
+
+    def stats(self):
+        entries, size = self.store.usage()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+def result_cache_from_env():
+    """Build the result cache configured through environment variables, or None if disabled"""
+    max_bytes = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+    if max_bytes <= 0:
+        return None
+    root = os.getenv("RESULT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "text2mathvideo", "results"))
+    return ResultCache(root, max_bytes)
@@ -0,0 +1,324 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import link_or_copy, result_cache_from_env
+from main import DELIVERY_POLICIES, QUALITY_FLAGS, AnimationGenerator, result_key, store_result
+from metrics import COALESCED_JOBS
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the job queue has reached its configured depth"""
+
+
+class Job:
+    """One client's request; identical requests share a single Flight"""
+
+    def __init__(self, prompt, work_dir, quality="auto", policy="final"):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.work_dir = work_dir
+        self.quality = quality
+        self.policy = policy
+        self.status = QUEUED
+        self.result = None
+        # Quality tier of the video currently available (preview or final)
+        self.result_quality = None
+        self.preview = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.flight = None
+        self.cached = False
+        self.coalesced = False
+        self.done = threading.Event()
+        # Set once a progressive job's preview is available, or the job has finished
+        self.preview_ready = threading.Event()
+
+    def to_dict(self):
+        """Public view of the job used by the status endpoint"""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'policy': self.policy,
+            'quality': self.quality,
+            'result_quality': self.result_quality,
+            'preview': self.preview is not None,
+            'cached': self.cached,
+            'coalesced': self.coalesced,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class Flight:
+    """A single pipeline run shared by every job waiting on the same result key.
+
+    Progressive flights first render at ``preview_quality`` and then upgrade
+    to ``quality``; they are kept apart from single-render flights of the same
+    key so every job on a flight wants the same deliveries.
+    """
+
+    def __init__(self, key, prompt, work_dir, quality="auto", preview_quality=None):
+        self.key = key
+        self.id = (key, preview_quality)
+        self.prompt = prompt
+        self.work_dir = work_dir
+        self.quality = quality
+        self.preview_quality = preview_quality
+        self.preview = None
+        self.jobs = []
+        self.started = False
+        self.cancel_event = threading.Event()
+        self.future = None
+
+
+class JobManager:
+    """Runs AnimationGenerator jobs on a bounded worker pool.
+
+    Requests are coalesced: while a run for a result key (normalized prompt,
+    model, quality, pipeline version) is queued or running, new jobs for the
+    same key attach to it instead of starting another run.
+    """
+
+    def __init__(self, max_workers=2, max_queue=32, work_root=None, retention=3600,
+                 generator_factory=AnimationGenerator, result_cache=None, quality="auto",
+                 preview_quality="low", policy="final"):
+        self.max_queue = max_queue
+        self.retention = retention
+        self.work_root = work_root or tempfile.mkdtemp(prefix="text2mathvideo_jobs_")
+        self.generator_factory = generator_factory
+        self.result_cache = result_cache
+        # Default quality tiers and delivery policy; each request may override them
+        self.quality = quality
+        self.preview_quality = preview_quality
+        self.policy = policy
+        self.jobs = {}
+        self.flights = {}
+        self.coalesced = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def resolve_delivery(self, quality=None, policy=None, preview_quality=None):
+        """Final quality, policy and preview quality (None unless progressive) for a request"""
+        quality = quality or self.quality
+        policy = policy or self.policy
+        preview_quality = preview_quality or self.preview_quality
+        if policy not in DELIVERY_POLICIES:
+            raise ValueError(f"Unknown delivery policy: {policy}")
+        for tier in (quality, preview_quality):
+            if tier != 'auto' and tier not in QUALITY_FLAGS:
+                raise ValueError(f"Unknown render quality: {tier}")
+        if policy == 'preview':
+            return preview_quality, policy, None
+        if policy == 'progressive':
+            # The preview already covers the fast path, so 'auto' (which drops
+            # long scenes to low quality) means the best tier for the upgrade
+            if quality == 'auto':
+                quality = 'high'
+            if quality != preview_quality:
+                return quality, policy, preview_quality
+        return quality, policy, None
+
+    def submit(self, prompt, quality=None, policy=None, preview_quality=None):
+        """Queue a new job (or attach it to an identical one in flight) without waiting for it to run.
+
+        Raises ValueError for an unknown quality tier or delivery policy.
+        """
+        quality, policy, preview_quality = self.resolve_delivery(quality, policy, preview_quality)
+        key = result_key(prompt, quality)
+        with self.lock:
+            self._prune()
+            flight = self.flights.get((key, preview_quality))
+            if flight is None:
+                queued = sum(1 for other in self.flights.values() if not other.started)
+                if queued >= self.max_queue:
+                    raise QueueFullError("Job queue is full, please try again later")
+            job = Job(prompt, tempfile.mkdtemp(dir=self.work_root), quality, policy)
+            self.jobs[job.id] = job
+
+            if flight is not None:
+                job.coalesced = True
+                self.coalesced += 1
+                COALESCED_JOBS.inc()
+                if flight.started:
+                    job.status = RUNNING
+                    job.started_at = time.time()
+                if flight.preview:
+                    self._give_preview(flight, job)
+            else:
+                # A cache hit finishes the job on the spot without touching the pool
+                entry = self.result_cache.get(key) if self.result_cache else None
+                if entry:
+                    job.result = link_or_copy(entry['video'], os.path.join(job.work_dir, "final_output.mp4"))
+                    job.result_quality = quality
+                    job.cached = True
+                    job.started_at = time.time()
+                    self._finish(job, SUCCEEDED)
+                    return job
+                flight = Flight(key, prompt, tempfile.mkdtemp(dir=self.work_root), quality, preview_quality)
+                self.flights[flight.id] = flight
+                flight.future = self.executor.submit(self._run, flight)
+            job.flight = flight
+            flight.jobs.append(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returning False if it already finished.
+
+        The shared run is only stopped once no other job is waiting on it.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return False
+            flight = job.flight
+            flight.jobs.remove(job)
+            self._finish(job, CANCELLED)
+            if not flight.jobs:
+                flight.cancel_event.set()
+                # New requests for this key must start a fresh run, not join a dying one
+                if self.flights.get(flight.id) is flight:
+                    del self.flights[flight.id]
+                # Runs that have not started yet can be dropped from the pool directly
+                if flight.future.cancel():
+                    shutil.rmtree(flight.work_dir, ignore_errors=True)
+            return True
+
+    def discard(self, job_id):
+        """Cancel a job if needed and forget it along with its files"""
+        self.cancel(job_id)
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+        if job is not None:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def _run(self, flight):
+        with self.lock:
+            if flight.cancel_event.is_set():
+                # Cancelled after the pool picked the run up, so cancel() could
+                # not drop the future and left the scratch directory to us
+                shutil.rmtree(flight.work_dir, ignore_errors=True)
+                return
+            flight.started = True
+            now = time.time()
+            for job in flight.jobs:
+                job.status = RUNNING
+                job.started_at = now
+        report_file = None
+        result_quality = flight.preview_quality or flight.quality
+        try:
+            generator = self.generator_factory(work_dir=flight.work_dir, cancel_event=flight.cancel_event,
+                                               quality=result_quality)
+            # Progressive runs keep the voiceover for the high quality re-render
+            keep_artifacts = self.result_cache is not None or flight.preview_quality is not None
+            result = generator.process(flight.prompt, keep_artifacts=keep_artifacts)
+            error = generator.error
+            report_file = generator.report_file
+            upgraded = flight.preview_quality is None
+            if result and not upgraded:
+                self._publish_preview(flight, result)
+                final = generator.upgrade(flight.quality)
+                if final:
+                    result, result_quality, upgraded = final, flight.quality, True
+                    report_file = generator.report_file
+                elif not flight.cancel_event.is_set():
+                    # Keep serving the preview rather than failing the job
+                    print(f"Keeping the {flight.preview_quality} quality preview: {generator.error}")
+            # Only final quality videos go in the cache, under the final quality key
+            if result and upgraded and self.result_cache:
+                store_result(self.result_cache, flight.key, flight.prompt, generator, result)
+        except Exception as e:
+            result = None
+            error = str(e)
+        with self.lock:
+            if self.flights.get(flight.id) is flight:
+                del self.flights[flight.id]
+            # Jobs that were cancelled have already left the flight
+            for job in flight.jobs:
+                if result:
+                    job.result = link_or_copy(result, os.path.join(job.work_dir, "final_output.mp4"))
+                    job.result_quality = result_quality
+                    if report_file and os.path.exists(report_file):
+                        link_or_copy(report_file, os.path.join(job.work_dir, "final_output.timings.json"))
+                    self._finish(job, SUCCEEDED)
+                else:
+                    job.error = error or "Failed to generate animation"
+                    self._finish(job, FAILED)
+            flight.jobs = []
+        shutil.rmtree(flight.work_dir, ignore_errors=True)
+
+    def _publish_preview(self, flight, preview_file):
+        """Hand the preview of a progressive flight to its jobs while the upgrade renders"""
+        with self.lock:
+            flight.preview = preview_file
+            for job in flight.jobs:
+                self._give_preview(flight, job)
+
+    def _give_preview(self, flight, job):
+        job.preview = link_or_copy(flight.preview, os.path.join(job.work_dir, "preview.mp4"))
+        job.result_quality = flight.preview_quality
+        job.preview_ready.set()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        if status != SUCCEEDED:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+        job.preview_ready.set()
+        job.done.set()
+
+    def _prune(self):
+        """Forget finished jobs (and their files) once the retention period is over"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.status in FINISHED_STATES and now - job.finished_at > self.retention:
+                shutil.rmtree(job.work_dir, ignore_errors=True)
+                del self.jobs[job_id]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'jobs': len(self.jobs),
+                'flights': len(self.flights),
+                'coalesced': self.coalesced,
+            }
+
+    def shutdown(self):
+        for flight in list(self.flights.values()):
+            flight.cancel_event.set()
+        self.executor.shutdown(wait=False)
+
+
+def job_manager_from_env(work_root=None):
+    """Build a JobManager configured through environment variables"""
+    return JobManager(
+        max_workers=int(os.getenv("JOB_WORKERS", "2")),
+        max_queue=int(os.getenv("JOB_QUEUE_DEPTH", "32")),
+        work_root=work_root,
+        retention=int(os.getenv("JOB_RETENTION_SECONDS", "3600")),
+        result_cache=result_cache_from_env(),
+        quality=os.getenv("RENDER_QUALITY", "auto"),
+        preview_quality=os.getenv("PREVIEW_QUALITY", "low"),
+        policy=os.getenv("DELIVERY_POLICY", "final"),
+    )
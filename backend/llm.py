@@ -0,0 +1,436 @@
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from metrics import LLM_RETRIES
+
+# Generation request kinds, used by the cache key and the stub backend
+CODE = "code"
+EXPLANATION = "explanation"
+FIX = "fix"
+
+# Lower runs first: a fix unblocks a job that is already rendering
+PRIORITIES = {FIX: 0, CODE: 1, EXPLANATION: 1}
+
+# Rough response sizes, reserved from the token budget before a call is made
+RESPONSE_TOKEN_ESTIMATES = {FIX: 2000, CODE: 2000, EXPLANATION: 500}
+
+# Quota exhaustion and transient server errors; anything else fails immediately
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RETRYABLE_ERRORS = ('ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded',
+                    'InternalServerError', 'BadGateway', 'GatewayTimeout')
+
+DEFAULT_ENDPOINT = "http://127.0.0.1:8080/generate"
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class RetryableLLMError(RuntimeError):
+    """A transient backend failure (rate limit, overload) that may succeed on retry"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    """Whether an LLM error is transient, judged by its type or HTTP status"""
+    if isinstance(error, (RetryableLLMError, ConnectionError, TimeoutError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    return getattr(error, 'code', None) in RETRYABLE_STATUSES
+
+
+def estimate_tokens(text):
+    """Cheap token count estimate (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+class LLMClient:
+    """Interface every language model backend implements"""
+
+    name = "base"
+
+    def generate(self, prompt, kind, description=""):
+        """Return the model's plain text response to the prompt"""
+        raise NotImplementedError
+
+    def discard(self, prompt, kind, description=""):
+        """Forget a remembered response; only meaningful for caching clients"""
+
+
+class GeminiClient(LLMClient):
+    """Google Gemini backend"""
+
+    def __init__(self, model_name, api_key=None):
+        import google.generativeai as genai
+
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in .env file")
+
+        genai.configure(api_key=api_key)
+        self.name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, kind, description=""):
+        response = self.model.generate_content(
+            prompt,
+            generation_config={
+                "response_mime_type": "text/plain",
+                "response_schema": {
+                    "type": "string",
+                    "description": description
+                }
+            }
+        )
+        return response.text
+
+
+class HTTPLLMClient(LLMClient):
+    """Minimal JSON-over-HTTP backend, e.g. a proxy or a local fake endpoint for load tests.
+
+    POSTs {"prompt", "kind", "description"} and expects {"text": ...} back.
+    """
+
+    def __init__(self, url, name="http", timeout=120):
+        self.url = url
+        self.name = name
+        self.timeout = timeout
+
+    def generate(self, prompt, kind, description=""):
+        body = json.dumps({'prompt': prompt, 'kind': kind, 'description': description}).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)['text']
+        except urllib.error.HTTPError as e:
+            if e.code in RETRYABLE_STATUSES:
+                retry_after = e.headers.get('Retry-After')
+                raise RetryableLLMError(f"HTTP {e.code} from {self.url}",
+                                        float(retry_after) if retry_after else None)
+            raise
+
+
+class TokenBucket:
+    """Allows ``rate_per_minute`` units per minute, bursting up to the same amount"""
+
+    def __init__(self, rate_per_minute, clock):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until ``amount`` units are available; oversized requests wait for a full bucket"""
+        self.refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0)
+
+    def take(self, amount):
+        self.refill()
+        # May go negative: a call that used more than it reserved pays it back later
+        self.tokens -= amount
+
+
+class LLMScheduler:
+    """Process-wide gate for LLM calls.
+
+    Enforces request and token per-minute budgets, caps the calls in flight,
+    serves waiting calls by priority, and retries only transient errors with
+    jittered exponential backoff.
+    """
+
+    def __init__(self, requests_per_minute=60, tokens_per_minute=1000000, max_in_flight=4, max_retries=5,
+                 backoff_base=1.0, backoff_max=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.requests = TokenBucket(requests_per_minute, clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self.in_flight = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.retries = 0
+
+    def acquire(self, priority, tokens):
+        """Block until this call heads the queue, has a free slot and fits both budgets"""
+        ticket = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                if self.waiting[0] == ticket and self.in_flight < self.max_in_flight:
+                    delay = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if delay <= 0:
+                        heapq.heappop(self.waiting)
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self.in_flight += 1
+                        self.condition.notify_all()
+                        return
+                    self.condition.wait(delay)
+                else:
+                    self.condition.wait()
+
+    def release(self, token_adjustment=0):
+        with self.condition:
+            self.in_flight -= 1
+            if token_adjustment:
+                self.tokens.take(token_adjustment)
+            self.condition.notify_all()
+
+    def backoff(self, attempt, error):
+        """Full-jitter exponential delay, never shorter than a server-provided Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = getattr(error, 'retry_after', None)
+        return max(delay, retry_after) if retry_after else delay
+
+    def call(self, func, priority=1, prompt_tokens=1, response_tokens=0):
+        """Run ``func`` (which returns the response text) under the scheduler's limits"""
+        reserved = prompt_tokens + response_tokens
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, reserved)
+            try:
+                text = func()
+            except Exception as e:
+                self.release()
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                print(f"LLM call failed ({str(e)}), retrying in {delay:.1f}s...")
+                with self.condition:
+                    self.retries += 1
+                LLM_RETRIES.inc()
+                self.sleep(delay)
+                continue
+            # Settle the reservation against what the response actually cost
+            self.release(prompt_tokens + estimate_tokens(text) - reserved)
+            return text
+
+    def stats(self):
+        with self.condition:
+            return {'in_flight': self.in_flight, 'waiting': len(self.waiting), 'retries': self.retries}
+
+
+class ScheduledLLMClient(LLMClient):
+    """Routes every call of another client through a shared LLMScheduler"""
+
+    def __init__(self, inner, scheduler):
+        self.inner = inner
+        self.name = inner.name
+        self.scheduler = scheduler
+
+    def generate(self, prompt, kind, description=""):
+        return self.scheduler.call(
+            lambda: self.inner.generate(prompt, kind, description),
+            priority=PRIORITIES.get(kind, 1),
+            prompt_tokens=estimate_tokens(prompt),
+            response_tokens=RESPONSE_TOKEN_ESTIMATES.get(kind, 1000),
+        )
+
+
+def get_llm_scheduler():
+    """Process-wide LLM scheduler configured through environment variables"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "60")),
+                tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000")),
+                max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "4")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+            )
+        return _scheduler
+
+
+class CachedLLMClient(LLMClient):
+    """Persistent prompt -> response memoization in front of another client"""
+
+    def __init__(self, inner, cache_dir):
+        self.inner = inner
+        self.name = inner.name
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, prompt, kind, description):
+        payload = json.dumps({
+            'model': self.inner.name,
+            'kind': kind,
+            'prompt': prompt,
+            'description': description,
+        }, sort_keys=True)
+        key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def generate(self, prompt, kind, description=""):
+        path = self.path_for(prompt, kind, description)
+        try:
+            with open(path) as f:
+                response = json.load(f)['response']
+            with self.lock:
+                self.hits += 1
+            return response
+        except (OSError, ValueError, KeyError):
+            pass
+
+        with self.lock:
+            self.misses += 1
+        response = self.inner.generate(prompt, kind, description)
+
+        # Write to a temporary name first so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'kind': kind, 'response': response}, f)
+        os.replace(tmp_path, path)
+        return response
+
+    def discard(self, prompt, kind, description=""):
+        try:
+            os.remove(self.path_for(prompt, kind, description))
+        except OSError:
+            pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+STUB_SCRIPTS = [
+    '''from manim import *
+
+class ExplanationScene(Scene):
+    def construct(self):
+        self.camera.background_color = BLACK
+
+        title = Text("Pythagorean Theorem", font_size=48)
+        self.play(Write(title))
+        self.wait(1)
+        self.play(title.animate.to_edge(UP))
+
+        triangle = Polygon([-2, -1, 0], [2, -1, 0], [-2, 2, 0], color=BLUE)
+        self.play(Create(triangle))
+        self.wait(1)
+
+        a_label = MathTex("a").next_to(triangle, LEFT)
+        b_label = MathTex("b").next_to(triangle, DOWN)
+        c_label = MathTex("c").move_to([0.4, 0.8, 0])
+        self.play(Write(a_label), Write(b_label), Write(c_label))
+        self.wait(1)
+
+        formula = MathTex("a^2 + b^2 = c^2").to_edge(DOWN)
+        self.play(Write(formula))
+        self.wait(2)
+''',
+    '''from manim import *
+
+class ExplanationScene(Scene):
+    def construct(self):
+        self.camera.background_color = BLACK
+
+        title = Text("Area of a Circle", font_size=48)
+        self.play(Write(title))
+        self.wait(1)
+        self.play(title.animate.to_edge(UP))
+
+        circle = Circle(radius=2, color=GREEN)
+        radius = Line(ORIGIN, RIGHT * 2, color=YELLOW)
+        r_label = MathTex("r").next_to(radius, UP)
+        self.play(Create(circle))
+        self.play(Create(radius), Write(r_label))
+        self.wait(1)
+
+        formula = MathTex("A = \\\\pi r^2").to_edge(DOWN)
+        self.play(Write(formula))
+        self.wait(2)
+''',
+]
+
+STUB_EXPLANATION = """[0.0s-2.5s]: Let's look at this idea step by step.
+[2.5s-5.0s]: First we introduce the shape we will be working with.
+[5.0s-8.0s]: Next we label each of its important parts.
+[8.0s-11.0s]: Finally the formula ties all of those parts together.
+"""
+
+
+class StubLLMClient(LLMClient):
+    """Deterministic offline backend serving canned Manim scripts.
+
+    Useful for load tests and benchmarks that should not need an API key.
+    """
+
+    name = "stub"
+
+    def __init__(self, scripts=None, explanation=None):
+        self.scripts = scripts or STUB_SCRIPTS
+        self.explanation = explanation or STUB_EXPLANATION
+
+    def generate(self, prompt, kind, description=""):
+        if kind == EXPLANATION:
+            return self.explanation
+        if kind == FIX:
+            # The canned scripts are known to render, so "fixing" returns the first one
+            return self.scripts[0]
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        return self.scripts[digest[0] % len(self.scripts)]
+
+
+def llm_model_name(default_model):
+    """Name of the model the configured backend actually answers with.
+
+    The name keys the response and result caches, so an http endpoint (often
+    a fake for load tests) never shares entries with the real model.
+    """
+    backend = os.getenv("LLM_BACKEND", "gemini")
+    if backend == "stub":
+        return StubLLMClient.name
+    if backend == "http":
+        return f"http:{os.getenv('LLM_ENDPOINT', DEFAULT_ENDPOINT)}"
+    return default_model
+
+
+def create_llm_client(model_name):
+    """Build the LLM client selected through environment variables.
+
+    LLM_BACKEND picks ``gemini`` (default), ``http`` (a JSON endpoint at
+    LLM_ENDPOINT) or ``stub``. Real backends share the process-wide rate
+    limiting scheduler and are wrapped in an on-disk response cache unless
+    LLM_CACHE_DIR is set to an empty string.
+    """
+    backend = os.getenv("LLM_BACKEND", "gemini")
+    if backend == "stub":
+        return StubLLMClient()
+    if backend == "gemini":
+        client = GeminiClient(model_name)
+    elif backend == "http":
+        client = HTTPLLMClient(os.getenv("LLM_ENDPOINT", DEFAULT_ENDPOINT), name=llm_model_name(model_name))
+    else:
+        raise ValueError(f"Unknown LLM backend: {backend}")
+
+    # The cache sits in front of the scheduler, so hits cost no quota
+    client = ScheduledLLMClient(client, get_llm_scheduler())
+    cache_dir = os.getenv("LLM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "text2mathvideo", "llm"))
+    if cache_dir:
+        client = CachedLLMClient(client, cache_dir)
+    return client
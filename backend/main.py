@@ -1,72 +1,206 @@
+import argparse
+import json
 import os
 import sys
 import shutil
 from dotenv import load_dotenv
-import google.generativeai as genai
-from gtts import gTTS
-from moviepy import AudioFileClip
 import subprocess
+import tempfile
 import textwrap
 import re
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline import Stage, run_stages
+from cache import cache_key, result_cache_from_env
+from llm import CODE, EXPLANATION, FIX, create_llm_client, llm_model_name
+from validation import CodeValidationError, validate_manim_code
+from render_pool import RenderCancelled, RenderError, get_render_pool
+from partial_cache import MAX_FILES_CACHED, get_partial_cache
+from scene_analysis import analyze_scene, format_timeline
+from tts import (BYTES_PER_SECOND as TTS_BYTES_PER_SECOND, create_fallback_engine, create_tts_engine, encode_mp3,
+                 get_phrase_cache, parse_segments, synthesize_timeline)
+from metrics import (FRAME_RATES, JOBS, OUTPUT_BYTES, RENDER_FPS, RENDER_RETRIES, JobReport, PipeReader,
+                     record_llm_call, record_popen, record_process, record_stages, run as run_measured,
+                     wait_rusage)
 
 # Load environment variables
 load_dotenv()
 
+MODEL_NAME = 'gemini-2.5-flash'
+# Bump whenever a pipeline change should invalidate previously cached videos
+PIPELINE_VERSION = 2
+
+# Finished videos put the moov atom first so players can start before the download ends
+FASTSTART = ['-movflags', '+faststart']
+
+# Smallest number of animations worth giving to a separate render process
+MIN_SEGMENT_ANIMATIONS = 4
+
+# Narration is spoken this much faster than the engine's normal rate
+VOICEOVER_TEMPO = 1.25
+
+# Fastest the narration may be sped up to fit the video before it is trimmed
+MAX_AUDIO_TEMPO = 1.15
+
+# Manim quality flags; 'auto' picks one from the estimated animation length
+QUALITY_FLAGS = {
+    'low': '-ql',
+    'medium': '-qm',
+    'high': '-qh',
+}
+
+# How a job delivers its video: 'final' renders once at the requested quality,
+# 'preview' renders only the fast preview tier, and 'progressive' returns the
+# preview first and then re-renders the same code at the final quality
+DELIVERY_POLICIES = ('final', 'preview', 'progressive')
+
+def result_key(prompt, quality):
+    """Result cache key for a prompt rendered at the given quality"""
+    return cache_key(prompt, llm_model_name(MODEL_NAME), quality, PIPELINE_VERSION)
+
+class GenerationCancelled(Exception):
+    """Raised when a job is cancelled between pipeline stages"""
+
 class AnimationGenerator:
-    def __init__(self):
-        self.gemini = self.initialize_gemini()
+    def __init__(self, work_dir=None, cancel_event=None, quality=None, llm=None, render_parallelism=None,
+                 sync_mode=None, render_backend=None, speculative_candidates=None, speculative_cancel=None,
+                 timing_report=None, tts_engine=None):
+        self.llm = llm or self.initialize_llm()
+        # Prompts sent during this run, so cached responses of a failed run can be dropped
+        self.llm_calls = []
+        self.quality = quality or os.getenv("RENDER_QUALITY", "auto")
+        if self.quality != 'auto' and self.quality not in QUALITY_FLAGS:
+            raise ValueError(f"Unknown render quality: {self.quality}")
+        # Number of Manim processes a single render may be split across
+        parallelism = render_parallelism or os.getenv("RENDER_PARALLELISM", "1")
+        if parallelism == "auto":
+            self.render_parallelism = os.cpu_count() or 1
+        else:
+            self.render_parallelism = int(parallelism)
+        # 'pool' renders in processes forked with Manim already imported, 'cli' shells out to manim
+        self.render_backend = render_backend or os.getenv("RENDER_BACKEND", "pool")
+        if self.render_backend not in ('pool', 'cli'):
+            raise ValueError(f"Unknown render backend: {self.render_backend}")
+        # Number of candidate scripts generated and rendered side by side (1 = off)
+        self.speculative_candidates = int(speculative_candidates or os.getenv("SPECULATIVE_CANDIDATES", "1"))
+        # 'first' stops the other candidates once one renders, 'all' lets them finish
+        self.speculative_cancel = speculative_cancel or os.getenv("SPECULATIVE_CANCEL", "first")
+        if self.speculative_cancel not in ('first', 'all'):
+            raise ValueError(f"Unknown speculative cancel policy: {self.speculative_cancel}")
+        # 'copy' keeps the rendered video stream as-is, 'reencode' time-stretches it
+        self.sync_mode = sync_mode or os.getenv("SYNC_MODE", "copy")
+        if self.sync_mode not in ('copy', 'reencode'):
+            raise ValueError(f"Unknown sync mode: {self.sync_mode}")
+        # Speech engine (TTS_ENGINE) plus an optional local fallback for its failures
+        self.tts = tts_engine or create_tts_engine()
+        self.tts_fallback = None if tts_engine else create_fallback_engine()
+        self.tts_parallelism = int(os.getenv("TTS_PARALLELISM", "4"))
+        self.manim_code = ""
         self.explanation = ""
         self.voiceover_duration = 0
-        self.animation_structure = []
-        
-    def initialize_gemini(self):
-        """Initialize the Gemini API client with environment variable"""
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in .env file")
+        self.audio_duration = 0
+        self.video_duration = None
+        self.animation_structure = None
+        # Every job gets its own scratch directory so several generators can
+        # run side by side without clobbering each other's files
+        self.work_dir = work_dir
+        self.owns_work_dir = False
+        # Optional threading.Event set by the job queue to stop a running job
+        self.cancel_event = cancel_event
+        # Set when a pipeline stage fails, so the stages running beside it stop too
+        self.stop_event = threading.Event()
+        self.error = None
+        self.stage_timings = {}
+        # Measurements of this run; written next to the output when TIMING_REPORT=1
+        self.report = JobReport()
+        if timing_report is None:
+            timing_report = os.getenv("TIMING_REPORT", "0") == "1"
+        self.timing_report = timing_report
+        self.report_file = None
         
-        genai.configure(api_key=api_key)
-        return genai.GenerativeModel('gemini-2.5-flash')
+    def initialize_llm(self):
+        """Initialize the LLM client selected by the environment (Gemini by default)"""
+        return create_llm_client(MODEL_NAME)
+    
+    def ask_llm(self, prompt, kind, description):
+        """Send a prompt to the LLM client and return the text response"""
+        self.llm_calls.append((prompt, kind, description))
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self.llm.generate(prompt, kind, description)
+            return response
+        finally:
+            record_llm_call(kind, time.perf_counter() - started, prompt, response, self.report)
+    
+    def run_command(self, name, args, **kwargs):
+        """subprocess.run() that records the command's cost under the given name"""
+        return run_measured(name, args, report=self.report, **kwargs)
+    
+    def is_cancelled(self):
+        return self.stop_event.is_set() or (self.cancel_event is not None and self.cancel_event.is_set())
+    
+    def check_cancelled(self):
+        """Stop the pipeline if the owning job has been cancelled"""
+        if self.is_cancelled():
+            raise GenerationCancelled("Job was cancelled")
+    
+    def prepare_workspace(self):
+        """Create the per-job scratch directory if it does not exist yet"""
+        if not self.work_dir:
+            self.work_dir = tempfile.mkdtemp(prefix="text2mathvideo_")
+            self.owns_work_dir = True
+        else:
+            self.work_dir = os.path.abspath(self.work_dir)
+            os.makedirs(self.work_dir, exist_ok=True)
+        return self.work_dir
+    
+    def workspace_path(self, *parts):
+        """Return an absolute path inside the job's scratch directory"""
+        if not self.work_dir or not os.path.isdir(self.work_dir):
+            self.prepare_workspace()
+        return os.path.join(self.work_dir, *parts)
+    
+    def cleanup_workspace(self, keep=()):
+        """Remove intermediate files, keeping the given paths"""
+        if not self.work_dir or not os.path.isdir(self.work_dir):
+            return
+        keep = {os.path.abspath(k) for k in keep if k}
+        for name in ["voiceover.mp3", "temp_animation.py", "output_animation.mp4", "segments.txt", "media"]:
+            path = self.workspace_path(name)
+            if path in keep or not os.path.exists(path):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        # Scratch directories of speculative candidates
+        for name in os.listdir(self.work_dir):
+            path = self.workspace_path(name)
+            if name.startswith("candidate_") and path not in keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        # Drop the directory itself if we created it and nothing is left in it
+        if self.owns_work_dir and not os.listdir(self.work_dir):
+            os.rmdir(self.work_dir)
     
     def extract_animation_structure(self, manim_code):
         """Extract the structure and timing from the generated Manim code"""
+        timeline = self.analyze_animation_structure(manim_code)
+        self.voiceover_duration = timeline['duration']
+        self.animation_structure = timeline
+        self.report.set(scene_duration=timeline['duration'], scene_timing_exact=timeline['exact'])
+        return timeline
+    
+    def analyze_animation_structure(self, manim_code):
+        """Time the code's animations without touching generator state.
+        
+        Returns the scene_analysis timeline: the play/wait events in execution
+        order, the segments they form, the total duration and whether every
+        duration was resolved exactly.
+        """
         try:
-            # Parse the code to understand animation sequence and timing
-            structure = []
-            
-            # Find all self.play and self.wait calls
-            play_pattern = r'self\.play\(([^)]+)\)'
-            wait_pattern = r'self\.wait\(([^)]+)\)'
-            
-            play_matches = re.findall(play_pattern, manim_code)
-            wait_matches = re.findall(wait_pattern, manim_code)
-            
-            # Estimate timing for each animation segment
-            total_duration = 0
-            for i, play_call in enumerate(play_matches):
-                # Each play call typically takes 1-2 seconds
-                anim_duration = 1.5  # default estimate
-                
-                # Check if there's a corresponding wait time
-                if i < len(wait_matches):
-                    try:
-                        wait_time = float(wait_matches[i])
-                        anim_duration += wait_time
-                    except:
-                        pass
-                
-                structure.append({
-                    'type': 'animation',
-                    'content': play_call,
-                    'duration': anim_duration
-                })
-                total_duration += anim_duration
-            
-            self.voiceover_duration = total_duration
-            self.animation_structure = structure
-            return structure
-            
+            return analyze_scene(manim_code)
         except Exception as e:
             raise RuntimeError(f"Failed to extract animation structure: {str(e)}")
     
@@ -101,18 +235,7 @@ class AnimationGenerator:
                 Fixed code:
                 """
                 
-                response = self.gemini.generate_content(
-                    fix_prompt,
-                    generation_config={
-                        "response_mime_type": "text/plain",
-                        "response_schema": {
-                            "type": "string",
-                            "description": "Fixed Python code for Manim animation"
-                        }
-                    }
-                )
-                
-                fixed_code = response.text
+                fixed_code = self.ask_llm(fix_prompt, FIX, "Fixed Python code for Manim animation")
                 
                 # Clean up the response (remove markdown code blocks if present)
                 if fixed_code.startswith('```python'):
@@ -135,10 +258,14 @@ class AnimationGenerator:
                 print(f"Error in fix attempt {attempt + 1}: {str(e)}")
                 if attempt == max_retries - 1:
                     raise RuntimeError(f"Failed to fix code after {max_retries} attempts: {str(e)}")
-                time.sleep(2)  # Wait before retrying
     
-    def generate_manim_code(self, prompt):
-        """Generate Manim code based on the prompt"""
+    def generate_manim_code(self, prompt, variant=None):
+        """Generate Manim code based on the prompt
+        
+        ``variant`` is an (index, count) pair used when several candidate scripts
+        are requested at once; every candidate after the first asks for a
+        different visual approach so the candidates (and their cache entries) differ.
+        """
         manim_prompt = textwrap.dedent(
             f"""
             Create a Manim Community Edition animation that visually explains:
@@ -183,18 +310,12 @@ class AnimationGenerator:
             """
         )
         
+        if variant and variant[0] > 0:
+            manim_prompt += (f"\nThis is design variant {variant[0] + 1} of {variant[1]}: "
+                             "use a visibly different layout and sequence of visuals than the most obvious one.\n")
+        
         try:
-            response = self.gemini.generate_content(
-                manim_prompt,
-                generation_config={
-                    "response_mime_type": "text/plain",
-                    "response_schema": {
-                        "type": "string",
-                        "description": "Raw Python code for Manim animation"
-                    }
-                }
-            )
-            code = response.text
+            code = self.ask_llm(manim_prompt, CODE, "Raw Python code for Manim animation")
             
             # Clean up the response
             if code.startswith('```python'):
@@ -218,18 +339,20 @@ class AnimationGenerator:
     def generate_explanation_for_animation(self, prompt, manim_code):
         """Generate an explanation that matches the animation structure"""
         # Extract animation structure first
-        structure = self.extract_animation_structure(manim_code)
+        timeline = self.extract_animation_structure(manim_code)
+        # Indent the timeline to line up with the rest of the prompt
+        structure = textwrap.indent(format_timeline(timeline), ' ' * 8).lstrip()
         
         explanation_prompt = f"""
         Create a concise, pedagogical voiceover script for this animation that explains: {prompt}
         
-        Animation structure analysis:
+        Animation timeline (start and end of every visual step, in seconds):
         {structure}
         
         Requirements:
         1. The explanation should perfectly match the animation sequence
-        2. Each animation segment should have corresponding narration
-        3. Total duration: {self.voiceover_duration} seconds
+        2. Each animation segment should have corresponding narration, using the timeline's times as cues
+        3. Total duration: {self.voiceover_duration:.1f} seconds
         4. Use simple language appropriate for the topic 
         5. Break down the explanation into parts that sync with visual elements
         6. Include appropriate pauses between concepts
@@ -245,17 +368,7 @@ class AnimationGenerator:
         """
         
         try:
-            response = self.gemini.generate_content(
-                explanation_prompt,
-                generation_config={
-                    "response_mime_type": "text/plain",
-                    "response_schema": {
-                        "type": "string",
-                        "description": "Voiceover script synchronized with animation"
-                    }
-                }
-            )
-            self.explanation = response.text
+            self.explanation = self.ask_llm(explanation_prompt, EXPLANATION, "Voiceover script synchronized with animation")
             return self.explanation
         except Exception as e:
             raise RuntimeError(f"Failed to generate explanation: {str(e)}")
@@ -263,169 +376,481 @@ class AnimationGenerator:
     def generate_voiceover(self):
         """Generate synchronized voiceover audio"""
         try:
-            # Extract just the text parts (remove timing comments)
-            clean_text = re.sub(r'\[\d+\.\d+s-\d+\.\d+s\]:', '', self.explanation)
-            clean_text = re.sub(r'#.*', '', clean_text)
-            clean_text = ' '.join(clean_text.split())  # Normalize whitespace
-            
-            tts = gTTS(text=clean_text, lang='en', slow=False)
-            tts.save("voiceover_normal.mp3")
-
-            # Increase speed by 1.25x using FFmpeg
-            subprocess.run([
-                'ffmpeg', '-y',
-                '-i', 'voiceover_normal.mp3',
-                '-filter:a', 'atempo=1.25',
-                'voiceover.mp3'
-            ], check=True)
+            # Each timed segment of the explanation is synthesized on its own,
+            # in parallel, and placed at its cue on the voiceover timeline
+            segments = parse_segments(self.explanation)
+            if not segments:
+                raise ValueError("The explanation has no narration text")
+            track, placements = synthesize_timeline(
+                self.tts, segments, rate=VOICEOVER_TEMPO, cache=get_phrase_cache(),
+                fallback=self.tts_fallback, workers=self.tts_parallelism, report=self.report)
             
-            # Clean up the temporary file
-            if os.path.exists("voiceover_normal.mp3"):
-                os.remove("voiceover_normal.mp3")
+            voiceover_file = self.workspace_path("voiceover.mp3")
+            with open(voiceover_file, 'wb') as f:
+                f.write(encode_mp3(track, report=self.report))
             
-            # Verify audio duration
-            audio = AudioFileClip("voiceover.mp3")
-            actual_duration = audio.duration
-            audio.close()
+            # The track length is exact, so the voiceover never needs probing
+            actual_duration = len(track) / TTS_BYTES_PER_SECOND
+            self.audio_duration = actual_duration
+            self.report.set(voiceover_placements=placements)
             
             # Adjust animation if needed
             if abs(actual_duration - self.voiceover_duration) > 2:
                 self.voiceover_duration = actual_duration
                 
-            return "voiceover.mp3"
+            return voiceover_file
         
         except Exception as e:
             raise RuntimeError(f"Failed to generate voiceover: {str(e)}")
     
-    def render_animation(self, manim_code, max_retries=3):
+    def find_manim_output(self, media_dir, quality_flag, output_name):
+        """Locate the video the manim CLI wrote for the given output name, or None"""
+        scene_videos_dir = os.path.join(media_dir, "videos", "temp_animation")
+        if not os.path.isdir(scene_videos_dir):
+            return None
+        
+        # Try the quality directory we asked for first, then any other one
+        quality_dir = {'-ql': "480p15", '-qm': "720p30", '-qh': "1080p60"}.get(quality_flag)
+        video_dirs = sorted(d for d in os.listdir(scene_videos_dir)
+                            if os.path.isdir(os.path.join(scene_videos_dir, d)))
+        if quality_dir in video_dirs:
+            video_dirs.remove(quality_dir)
+            video_dirs.insert(0, quality_dir)
+        
+        for video_dir in video_dirs:
+            media_files_dir = os.path.join(scene_videos_dir, video_dir)
+            for f in os.listdir(media_files_dir):
+                if f.startswith(output_name) and f.endswith('.mp4'):
+                    return os.path.join(media_files_dir, f)
+        return None
+    
+    def run_manim(self, script_file, quality_flag, media_dir, output_name, animation_range=None,
+                  should_stop=None):
+        """Run one Manim render, optionally limited to a range of animation numbers.
+        
+        Returns (output_path, duration); duration is None when it is not known.
+        """
+        os.makedirs(media_dir, exist_ok=True)
+        
+        # Reuse partial movies rendered by earlier jobs and attempts
+        partial_cache = get_partial_cache()
+        partial_dir = None
+        seeded = set()
+        if partial_cache:
+            partial_dir = os.path.join(media_dir, "partial_movie_files")
+            seeded = partial_cache.seed(partial_dir, quality_flag)
+        
+        succeeded = False
+        try:
+            if self.render_backend == 'pool':
+                result = self.run_manim_pool(script_file, quality_flag, media_dir, output_name,
+                                             animation_range, partial_dir, should_stop)
+            else:
+                result = self.run_manim_cli(script_file, quality_flag, media_dir, output_name,
+                                            animation_range, partial_dir, should_stop)
+            succeeded = True
+            return result
+        except RenderCancelled:
+            raise GenerationCancelled("Render was cancelled")
+        finally:
+            # Animations that finished before a failure are still worth keeping
+            # for the retry that follows
+            if partial_cache:
+                partial_cache.publish(partial_dir, quality_flag, seeded, succeeded)
+    
+    def run_manim_pool(self, script_file, quality_flag, media_dir, output_name, animation_range, partial_dir,
+                       should_stop):
+        """Render on the worker pool, which reports the output path directly"""
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = get_render_pool().render(script_file, quality_flag, media_dir, output_name,
+                                              animation_range, partial_dir, should_stop=should_stop)
+            ok = True
+        finally:
+            # Failed and cancelled renders report no worker usage, only wall time
+            usage = result if ok else {}
+            record_process('manim', time.perf_counter() - started, usage.get('cpu_seconds'),
+                           usage.get('peak_rss_bytes'), ok, self.report, usage.get('write_bytes'))
+        return result['path'], None if animation_range else result['duration']
+    
+    def run_manim_cli(self, script_file, quality_flag, media_dir, output_name, animation_range, partial_dir,
+                      should_stop):
+        """Render by running the manim command in a subprocess"""
+        cmd = ['manim', quality_flag, '--media_dir', media_dir]
+        if partial_dir:
+            # The CLI has no flag for the partial movie directory, so pass a
+            # per-render config file
+            config_file = os.path.join(media_dir, "manim.cfg")
+            with open(config_file, 'w') as f:
+                f.write(f"[CLI]\npartial_movie_dir = {partial_dir}\nmax_files_cached = {MAX_FILES_CACHED}\n")
+            cmd += ['--config_file', config_file]
+        else:
+            cmd.append('--disable_caching')
+        if animation_range:
+            cmd += ['-n', ','.join(str(n) for n in animation_range)]
+        cmd += [script_file, 'ExplanationScene', '-o', output_name]
+        
+        # Run the command and capture output, killing it if the render is abandoned
+        started = time.perf_counter()
+        process = subprocess.Popen(cmd, cwd=os.path.dirname(script_file),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        pipes = PipeReader(process)
+        while not pipes.join(timeout=0.5):
+            if should_stop is not None and should_stop():
+                process.kill()
+                record_popen('manim', process, wait_rusage(process), started, self.report)
+                raise RenderCancelled("Render was cancelled")
+        record_popen('manim', process, wait_rusage(process), started, self.report)
+        stdout, stderr = pipes.result()
+        if process.returncode != 0:
+            raise RenderError(f"STDERR: {stderr}\nSTDOUT: {stdout}")
+        return self.find_manim_output(media_dir, quality_flag, output_name), None
+    
+    def plan_segments(self, manim_code):
+        """Split the scene into animation-number ranges that can render independently.
+        
+        Every self.play/self.wait call is one Manim animation. The last range is
+        left open so animations the static count missed (loops, helpers) are
+        still rendered. Returns [None] when the scene should render in one piece.
+        """
+        try:
+            count = sum(1 for event in analyze_scene(manim_code)['events'] if event['type'] in ('play', 'wait'))
+        except Exception as e:
+            # Splitting is only an optimization; never fail a render over it
+            print(f"Scene analysis failed, rendering in one piece: {str(e)}")
+            return [None]
+        segments = min(self.render_parallelism, count // MIN_SEGMENT_ANIMATIONS)
+        if segments < 2:
+            return [None]
+        size = -(-count // segments)
+        ranges = [(i * size, (i + 1) * size - 1) for i in range(segments - 1)]
+        ranges.append(((segments - 1) * size,))
+        return ranges
+    
+    def render_segments(self, script_file, quality_flag, segments, output_file, should_stop=None):
+        """Render animation ranges on separate Manim processes and join them without re-encoding"""
+        render_dir = os.path.dirname(script_file)
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix="segment") as executor:
+            futures = [
+                executor.submit(self.run_manim, script_file, quality_flag,
+                                os.path.join(render_dir, "media", f"segment_{i}"), f"segment_{i}", segment,
+                                should_stop)
+                for i, segment in enumerate(segments)
+            ]
+            parts = [future.result()[0] for future in futures]
+        
+        # A range past the real end of the scene produces no file; that is fine
+        parts = [part for part in parts if part]
+        if not parts:
+            raise FileNotFoundError("No animation segments were rendered")
+        
+        list_file = os.path.join(render_dir, "segments.txt")
+        with open(list_file, 'w') as f:
+            for part in parts:
+                escaped = part.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        self.run_command('ffmpeg_concat', [
+            'ffmpeg', '-y',
+            '-f', 'concat', '-safe', '0',
+            '-i', list_file,
+            '-c', 'copy',
+            output_file
+        ], check=True, capture_output=True, text=True)
+        os.remove(list_file)
+        return output_file
+    
+    def render_once(self, manim_code, quality_flag, render_dir, should_stop=None):
+        """Validate and render a script once in the given directory, returning (video_path, duration)"""
+        # Reject broken scripts before paying for a Manim process
+        errors = validate_manim_code(manim_code)
+        if errors:
+            raise CodeValidationError(errors)
+        
+        os.makedirs(render_dir, exist_ok=True)
+        script_file = os.path.join(render_dir, "temp_animation.py")
+        with open(script_file, 'w') as f:
+            f.write(manim_code)
+        
+        # Start from an empty media directory so no stale output from an
+        # earlier attempt can be picked up
+        media_dir = os.path.join(render_dir, "media")
+        shutil.rmtree(media_dir, ignore_errors=True)
+        final_path = os.path.join(render_dir, "output_animation.mp4")
+        segments = self.plan_segments(manim_code)
+        if len(segments) > 1:
+            print(f"Rendering {len(segments)} segments in parallel...")
+            self.render_segments(script_file, quality_flag, segments, final_path, should_stop)
+            return final_path, None
+        
+        # Each job renders into its own media directory
+        output_path, duration = self.run_manim(script_file, quality_flag, media_dir, "output_animation",
+                                               should_stop=should_stop)
+        if not output_path:
+            raise FileNotFoundError("No animation file found in the Manim media directory")
+        # Copy to the render directory for easier access
+        shutil.copy2(output_path, final_path)
+        return final_path, duration
+    
+    def render_animation(self, manim_code, max_retries=3, quality_flag=None):
         """Render the Manim animation with error feedback and retry mechanism"""
+        if quality_flag is None:
+            quality_flag = self.select_quality(self.voiceover_duration)
         for attempt in range(max_retries):
+            self.check_cancelled()
             try:
-                with open("temp_animation.py", 'w') as f:
-                    f.write(manim_code)
-                
-                # Create media directory if it doesn't exist
-                media_dir = os.path.join(os.getcwd(), "media")
-                os.makedirs(media_dir, exist_ok=True)
+                started = time.perf_counter()
+                final_path, self.video_duration = self.render_once(manim_code, quality_flag, self.work_dir,
+                                                                   should_stop=self.is_cancelled)
+                self.report.set(quality=quality_flag, render_seconds=round(time.perf_counter() - started, 3))
                 
-                # Render with quality matching the duration
-                quality_flag = '-ql' if self.voiceover_duration > 45 else '-qh'
-                cmd = f"manim --disable_caching {quality_flag} temp_animation.py ExplanationScene -o output_animation"
+                # Remember the code that actually rendered (it may have been fixed)
+                self.manim_code = manim_code
+                return final_path
                 
-                # Run the command and capture output
-                result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
+            except GenerationCancelled:
+                raise
                 
-                # Find the actual output file in the media directory
-                media_files_dir = os.path.join(media_dir, "videos", "temp_animation", "480p15")
-                if not os.path.exists(media_files_dir):
-                    # Try different quality directories
-                    quality_dir = "1080p60" if quality_flag == '-qh' else "480p15"
-                    media_files_dir = os.path.join(media_dir, "videos", "temp_animation", quality_dir)
-                    if not os.path.exists(media_files_dir):
-                        # Try to find any output directory
-                        video_dirs = [d for d in os.listdir(os.path.join(media_dir, "videos", "temp_animation")) 
-                                    if os.path.isdir(os.path.join(media_dir, "videos", "temp_animation", d))]
-                        if video_dirs:
-                            media_files_dir = os.path.join(media_dir, "videos", "temp_animation", video_dirs[0])
-                        else:
-                            raise FileNotFoundError(f"Manim output directory not found")
+            except CodeValidationError as e:
+                error_output = str(e)
+                print(f"Validation failed on attempt {attempt + 1}: {error_output}")
+                self.count_render_retry('validation')
                 
-                # Look for the output file
-                for f in os.listdir(media_files_dir):
-                    if f.startswith("output_animation") and f.endswith('.mp4'):
-                        output_path = os.path.join(media_files_dir, f)
-                        # Copy to current directory for easier access
-                        final_path = os.path.join(os.getcwd(), "output_animation.mp4")
-                        shutil.copy2(output_path, final_path)
-                        return final_path
-                
-                raise FileNotFoundError(f"No animation file found in {media_files_dir}")
-                
-            except subprocess.CalledProcessError as e:
-                error_output = f"STDERR: {e.stderr}\nSTDOUT: {e.stdout}"
+                if attempt < max_retries - 1:
+                    # Nothing was rendered, so go straight back to the fix loop
+                    manim_code = self.fix_code_with_error_feedback(manim_code, error_output)
+                else:
+                    raise RuntimeError(f"Generated code failed validation after {max_retries} attempts: {error_output}")
+                    
+            except RenderError as e:
+                error_output = str(e)
                 print(f"Rendering failed on attempt {attempt + 1}: {error_output}")
+                self.count_render_retry('render')
                 
                 if attempt < max_retries - 1:
                     # Try to fix the code with error feedback
                     print("Attempting to fix code with error feedback...")
                     manim_code = self.fix_code_with_error_feedback(manim_code, error_output)
-                    time.sleep(2)  # Wait before retrying
                 else:
                     raise RuntimeError(f"Manim rendering failed after {max_retries} attempts: {error_output}")
                     
             except Exception as e:
+                self.count_render_retry('error')
                 if attempt < max_retries - 1:
                     print(f"Error on attempt {attempt + 1}: {str(e)}")
-                    time.sleep(2)  # Wait before retrying
                 else:
                     raise RuntimeError(f"Failed to render animation after {max_retries} attempts: {str(e)}")
     
-    def synchronize_media(self, video_file):
+    def count_render_retry(self, reason):
+        RENDER_RETRIES.inc(reason=reason)
+        self.report.increment('render_retries')
+    
+    def render_speculative(self, prompt, max_retries=3):
+        """Generate several candidate scripts at once and keep the first one that renders.
+        
+        Candidates are generated, validated and rendered in parallel. With the
+        'first' cancel policy the remaining candidates are stopped as soon as one
+        succeeds; with 'all' every candidate runs to completion and the earliest
+        successful candidate (in request order) wins. If all candidates fail,
+        the first one goes through the usual error-feedback repair loop.
+        Returns (manim_code, quality_flag, video_path).
+        """
+        count = self.speculative_candidates
+        stop = threading.Event()
+        
+        def should_stop():
+            return stop.is_set() or self.is_cancelled()
+        
+        def run_candidate(index):
+            manim_code = self.generate_manim_code(prompt, variant=(index, count))
+            quality_flag = self.estimate_quality(manim_code)
+            if should_stop():
+                return None
+            started = time.perf_counter()
+            try:
+                video_file, duration = self.render_once(manim_code, quality_flag,
+                                                        self.workspace_path(f"candidate_{index}"), should_stop)
+            except (CodeValidationError, RenderError) as e:
+                return {'index': index, 'code': manim_code, 'quality': quality_flag, 'error': str(e)}
+            return {'index': index, 'code': manim_code, 'quality': quality_flag,
+                    'video': video_file, 'duration': duration, 'seconds': time.perf_counter() - started}
+        
+        print(f"Generating {count} candidate scripts...")
+        executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix="candidate")
+        futures = [executor.submit(run_candidate, index) for index in range(count)]
+        results = []
+        winner = None
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except GenerationCancelled:
+                    continue
+                except Exception as e:
+                    print(f"Candidate failed: {str(e)}")
+                    continue
+                if not result:
+                    continue
+                results.append(result)
+                if 'video' in result and self.speculative_cancel == 'first':
+                    winner = result
+                    stop.set()
+                    break
+        finally:
+            # Stragglers notice the stop flag and exit on their own
+            executor.shutdown(wait=self.speculative_cancel == 'all')
+        self.check_cancelled()
+        
+        if winner is None:
+            successes = sorted((r for r in results if 'video' in r), key=lambda r: r['index'])
+            winner = successes[0] if successes else None
+        if winner is not None:
+            print(f"Candidate {winner['index'] + 1}/{count} rendered first")
+            self.manim_code = winner['code']
+            self.video_duration = winner['duration']
+            self.report.set(quality=winner['quality'], render_seconds=round(winner['seconds'], 3))
+            return winner['code'], winner['quality'], winner['video']
+        
+        # Every candidate failed: fall back to repairing the first one
+        failures = sorted(results, key=lambda r: r['index'])
+        if not failures:
+            raise RuntimeError("No candidate script could be generated")
+        failure = failures[0]
+        print(f"All {count} candidates failed, repairing candidate {failure['index'] + 1}...")
+        manim_code = self.fix_code_with_error_feedback(failure['code'], failure['error'])
+        video_file = self.render_animation(manim_code, max_retries=max(max_retries - 1, 1),
+                                           quality_flag=failure['quality'])
+        return self.manim_code, failure['quality'], video_file
+    
+    def probe_durations(self, *filenames):
+        """Read the durations of several media files with a single ffmpeg call"""
+        # ffmpeg exits with an error when no output is given, but it still
+        # prints one "Duration:" line per input, in input order; only a
+        # missing Duration line means the probe failed
+        cmd = ['ffmpeg', '-hide_banner']
+        for filename in filenames:
+            cmd += ['-i', filename]
+        result = self.run_command('ffmpeg_probe', cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                  ok_returncodes=(1,))
+        durations = [
+            int(h) * 3600 + int(m) * 60 + float(sec)
+            for h, m, sec in re.findall(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stdout)
+        ]
+        if len(durations) != len(filenames):
+            raise RuntimeError(f"Could not read media durations: {result.stdout[-500:]}")
+        return durations
+    
+    def mux_copy_video(self, video_file, voiceover_file, video_duration, audio_duration, output_file):
+        """Mux without touching the video stream; only the audio is fitted to the video"""
+        filters = []
+        if audio_duration > video_duration:
+            # Speed the narration up a little, then trim whatever still overhangs
+            tempo = min(audio_duration / video_duration, MAX_AUDIO_TEMPO)
+            filters.append(f'atempo={tempo:.4f}')
+        elif audio_duration < video_duration:
+            # Pad with silence until the video ends
+            filters.append('apad')
+        
+        cmd = [
+            'ffmpeg', '-y',
+            '-i', video_file,
+            '-i', voiceover_file,
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+            '-c:v', 'copy',
+        ]
+        if filters:
+            cmd += ['-filter:a', ','.join(filters)]
+        cmd += ['-c:a', 'aac', '-t', f'{video_duration:.3f}'] + FASTSTART + [output_file]
+        self.run_command('ffmpeg_mux', cmd, check=True, capture_output=True, text=True)
+    
+    def mux_reencode(self, video_file, voiceover_file, video_duration, audio_duration, output_file):
+        """Mux by re-encoding the video so its length matches the narration"""
+        # Case 1: Audio is longer than video - trim audio
+        if audio_duration > video_duration:
+            self.run_command('ffmpeg_mux', [
+                'ffmpeg', '-y',
+                '-i', video_file,
+                '-i', voiceover_file,
+                '-filter_complex', 
+                f'[0:v]setpts=PTS-STARTPTS[v];[1:a]atrim=0:{video_duration},asetpts=PTS-STARTPTS[a]',
+                '-map', '[v]',
+                '-map', '[a]',
+                '-c:v', 'libx264',
+                '-c:a', 'aac',
+                '-shortest',
+                *FASTSTART,
+                output_file
+            ], check=True)
+        
+        # Case 2: Video is longer than audio - speed up video slightly
+        elif audio_duration < video_duration:
+            speed_factor = audio_duration / video_duration
+            self.run_command('ffmpeg_mux', [
+                'ffmpeg', '-y',
+                '-i', video_file,
+                '-i', voiceover_file,
+                '-filter_complex',
+                f'[0:v]setpts={1/speed_factor}*PTS[v]',
+                '-map', '[v]',
+                '-map', '1:a',
+                '-c:v', 'libx264',
+                '-c:a', 'aac',
+                *FASTSTART,
+                output_file
+            ], check=True)
+        
+        # Case 3: Durations match exactly
+        else:
+            self.run_command('ffmpeg_mux', [
+                'ffmpeg', '-y',
+                '-i', video_file,
+                '-i', voiceover_file,
+                '-c:v', 'copy',
+                '-c:a', 'aac',
+                '-map', '0:v:0',
+                '-map', '1:a:0',
+                *FASTSTART,
+                output_file
+            ], check=True)
+    
+    def synchronize_media(self, video_file, output_file=None):
         """Combine video and audio with perfect synchronization using ffmpeg"""
         try:
-            # Get durations using ffprobe
-            def get_duration(filename):
-                result = subprocess.run([
-                    'ffprobe', '-v', 'error', '-show_entries', 
-                    'format=duration', '-of', 
-                    'default=noprint_wrappers=1:nokey=1', filename
-                ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-                return float(result.stdout)
-
-            video_duration = get_duration(video_file)
-            audio_duration = get_duration("voiceover.mp3")
+            voiceover_file = self.workspace_path("voiceover.mp3")
+            # The voiceover stage already measured the narration and render
+            # workers report the video length, so probing is usually skipped.
+            # The analyzed scene length is never used here: -t would silently
+            # cut the video wherever the analysis guessed wrong
+            if self.audio_duration and self.video_duration:
+                video_duration, audio_duration = self.video_duration, self.audio_duration
+            elif self.audio_duration:
+                video_duration, = self.probe_durations(video_file)
+                audio_duration = self.audio_duration
+            else:
+                video_duration, audio_duration = self.probe_durations(video_file, voiceover_file)
+            self.video_duration = video_duration
 
-            output_file = "final_output.mp4"
-            
-            # Case 1: Audio is longer than video - trim audio
-            if audio_duration > video_duration:
-                subprocess.run([
-                    'ffmpeg', '-y',
-                    '-i', video_file,
-                    '-i', 'voiceover.mp3',
-                    '-filter_complex', 
-                    f'[0:v]setpts=PTS-STARTPTS[v];[1:a]atrim=0:{video_duration},asetpts=PTS-STARTPTS[a]',
-                    '-map', '[v]',
-                    '-map', '[a]',
-                    '-c:v', 'libx264',
-                    '-c:a', 'aac',
-                    '-shortest',
-                    output_file
-                ], check=True)
-            
-            # Case 2: Video is longer than audio - speed up video slightly
-            elif audio_duration < video_duration:
-                speed_factor = audio_duration / video_duration
-                subprocess.run([
-                    'ffmpeg', '-y',
-                    '-i', video_file,
-                    '-i', 'voiceover.mp3',
-                    '-filter_complex',
-                    f'[0:v]setpts={1/speed_factor}*PTS[v]',
-                    '-map', '[v]',
-                    '-map', '1:a',
-                    '-c:v', 'libx264',
-                    '-c:a', 'aac',
-                    output_file
-                ], check=True)
+            if not output_file:
+                output_file = self.workspace_path("final_output.mp4")
+            # Never write through an old file: it may be hard-linked into the result cache
+            if os.path.exists(output_file):
+                os.remove(output_file)
             
-            # Case 3: Durations match exactly
+            if self.sync_mode == 'copy':
+                try:
+                    self.mux_copy_video(video_file, voiceover_file, video_duration, audio_duration, output_file)
+                except subprocess.CalledProcessError as e:
+                    print(f"Stream-copy mux failed, falling back to a full re-encode: {e.stderr}")
+                    self.mux_reencode(video_file, voiceover_file, video_duration, audio_duration, output_file)
             else:
-                subprocess.run([
-                    'ffmpeg', '-y',
-                    '-i', video_file,
-                    '-i', 'voiceover.mp3',
-                    '-c:v', 'copy',
-                    '-c:a', 'aac',
-                    '-map', '0:v:0',
-                    '-map', '1:a:0',
-                    output_file
-                ], check=True)
+                self.mux_reencode(video_file, voiceover_file, video_duration, audio_duration, output_file)
 
             # Clean up
-            for f in [video_file, "temp_animation.py"]:
+            for f in [video_file, self.workspace_path("temp_animation.py")]:
                 if os.path.exists(f):
                     os.remove(f)
+            shutil.rmtree(self.workspace_path("media"), ignore_errors=True)
                     
             return output_file
         except subprocess.CalledProcessError as e:
@@ -433,51 +858,380 @@ class AnimationGenerator:
         except Exception as e:
             raise RuntimeError(f"Failed to synchronize media: {str(e)}")
     
-    def process(self, prompt):
-        """Full pipeline from prompt to final video"""
+    def estimate_quality(self, manim_code):
+        """Pick the render quality from the code's estimated duration alone"""
         try:
+            duration = analyze_scene(manim_code)['duration']
+        except Exception as e:
+            # An unknown length counts as a long one and gets the cheaper quality
+            print(f"Scene analysis failed, using the quality for long scenes: {str(e)}")
+            duration = float('inf')
+        return self.select_quality(duration)
+    
+    def select_quality(self, estimated_duration):
+        """Pick the Manim quality flag for an animation of the given length"""
+        if self.quality != 'auto':
+            return QUALITY_FLAGS[self.quality]
+        return '-ql' if estimated_duration > 45 else '-qh'
+    
+    def artifacts(self):
+        """Intermediate artifacts of the last run, as stored in the result cache"""
+        voiceover_file = self.workspace_path("voiceover.mp3")
+        return {
+            'code': self.manim_code,
+            'explanation': self.explanation,
+            'voiceover_file': voiceover_file if os.path.exists(voiceover_file) else None,
+        }
+    
+    def process(self, prompt, output_path=None, keep_artifacts=False):
+        """Full pipeline from prompt to final video"""
+        self.prepare_workspace()
+        
+        def code_stage():
             print("Generating animation code...")
             manim_code = self.generate_manim_code(prompt)
-            
+            # Decide the render quality from the code alone so rendering does
+            # not have to wait for the explanation or the voiceover
+            return manim_code, self.estimate_quality(manim_code)
+        
+        def explanation_stage(code_result):
             print("Creating synchronized explanation...")
-            explanation = self.generate_explanation_for_animation(prompt, manim_code)
-            
+            return self.generate_explanation_for_animation(prompt, code_result[0])
+        
+        def voiceover_stage(explanation):
             print("Generating voiceover...")
-            self.generate_voiceover()
-            
+            return self.generate_voiceover()
+        
+        def render_stage(code_result):
             print("Rendering animation...")
-            video_file = self.render_animation(manim_code, max_retries=3)
-            
+            manim_code, quality_flag = code_result
+            video_file = self.render_animation(manim_code, max_retries=3, quality_flag=quality_flag)
+            return self.manim_code, video_file
+        
+        def speculative_stage():
+            manim_code, quality_flag, video_file = self.render_speculative(prompt, max_retries=3)
+            return manim_code, video_file
+        
+        def sync_stage(render_result, voiceover_file):
             print("Combining media...")
-            final_file = self.synchronize_media(video_file)
+            return self.synchronize_media(render_result[1], output_path)
+        
+        if self.speculative_candidates > 1:
+            # Which script wins is only known once rendering finishes, so the
+            # explanation is written for the winning candidate afterwards
+            stages = [
+                Stage('render', speculative_stage),
+                Stage('explanation', explanation_stage, deps=['render']),
+                Stage('voiceover', voiceover_stage, deps=['explanation']),
+                Stage('sync', sync_stage, deps=['render', 'voiceover']),
+            ]
+        else:
+            # Voiceover only needs the explanation and rendering only needs the
+            # code, so the two branches run side by side
+            stages = [
+                Stage('code', code_stage),
+                Stage('explanation', explanation_stage, deps=['code']),
+                Stage('voiceover', voiceover_stage, deps=['explanation']),
+                Stage('render', render_stage, deps=['code']),
+                Stage('sync', sync_stage, deps=['render', 'voiceover']),
+            ]
+        
+        started = time.perf_counter()
+        self.stop_event.clear()
+        try:
+            results, _ = run_stages(stages, check=self.check_cancelled, timings=self.stage_timings,
+                                    on_error=lambda error: self.stop_event.set())
+            final_file = results['sync']
+            keep = [final_file]
+            if keep_artifacts:
+                keep.append(self.workspace_path("voiceover.mp3"))
+            self.cleanup_workspace(keep=keep)
+            self.finish_report('succeeded', time.perf_counter() - started, final_file)
+            
+            print("\nStage timings:")
+            for name, timing in self.stage_timings.items():
+                print(f"  {name:<12} {timing['start']:8.2f}s -> {timing['end']:8.2f}s "
+                      f"({timing['duration']:.2f}s, cpu {timing['cpu']:.2f}s)")
+            print(f"  total        {time.perf_counter() - started:.2f}s")
             
             print(f"\nDone! Final video saved as: {final_file}")
             return final_file
         except Exception as e:
             print(f"\nError: {str(e)}")
+            self.error = str(e)
+            self.finish_report('cancelled' if isinstance(e, GenerationCancelled) else 'failed',
+                               time.perf_counter() - started)
+            # Don't let a cached bad response doom every retry of this prompt
+            for call in self.llm_calls:
+                self.llm.discard(*call)
             # Clean up any partial files
-            for f in ["voiceover.mp3", "temp_animation.py"]:
-                if os.path.exists(f):
-                    os.remove(f)
+            self.cleanup_workspace()
             return None
+    
+    def upgrade(self, quality, output_path=None):
+        """Re-render the code of a finished run at another quality and mux it with the same voiceover.
+        
+        The code already rendered once and the narration is kept, so no LLM or
+        TTS calls are made. Needs a previous process() call with
+        keep_artifacts=True. Returns the new video, or None on failure.
+        """
+        if quality != 'auto' and quality not in QUALITY_FLAGS:
+            raise ValueError(f"Unknown render quality: {quality}")
+        voiceover_file = self.workspace_path("voiceover.mp3")
+        if not self.manim_code or not os.path.exists(voiceover_file):
+            raise RuntimeError("Nothing to upgrade: run process() with keep_artifacts=True first")
+        self.quality = quality
+        self.error = None
+        
+        def upgrade_stage():
+            print(f"Re-rendering at {quality} quality...")
+            quality_flag = self.select_quality(self.voiceover_duration)
+            started = time.perf_counter()
+            video_file, self.video_duration = self.render_once(self.manim_code, quality_flag, self.work_dir,
+                                                               should_stop=self.is_cancelled)
+            self.report.set(quality=quality_flag, render_seconds=round(time.perf_counter() - started, 3))
+            return self.synchronize_media(video_file, output_path or self.workspace_path("final_output_hq.mp4"))
+        
+        started = time.perf_counter()
+        timings = {}
+        status, final_file = 'failed', None
+        try:
+            results, _ = run_stages([Stage('upgrade', upgrade_stage)], check=self.check_cancelled, timings=timings)
+            final_file = results['upgrade']
+            status = 'succeeded'
+            self.cleanup_workspace(keep=[final_file, voiceover_file])
+            print(f"Upgraded video saved as: {final_file} ({timings['upgrade']['duration']:.2f}s)")
+        except Exception as e:
+            print(f"\nUpgrade failed: {str(e)}")
+            self.error = str(e)
+            if isinstance(e, GenerationCancelled):
+                status = 'cancelled'
+        self.stage_timings.update(timings)
+        self.finish_report(status, time.perf_counter() - started, final_file, timings=timings)
+        return final_file
+    
+    def finish_report(self, status, seconds, final_file=None, timings=None):
+        """Publish the run's measurements and write the JSON timing report if enabled.
+        
+        Follow-up runs such as upgrade() pass their own stage ``timings`` so
+        only those stages are recorded and the job is not counted twice.
+        """
+        if timings is None:
+            JOBS.inc(status=status)
+            timings = self.stage_timings
+        record_stages(timings)
+        self.report.set(stages=dict(self.stage_timings), status=status, total_seconds=round(seconds, 3),
+                        error=self.error)
+        if not final_file:
+            return
+        
+        output_bytes = os.path.getsize(final_file)
+        OUTPUT_BYTES.observe(output_bytes)
+        self.report.set(output_bytes=output_bytes, video_duration=self.video_duration)
+        summary = self.report.to_dict()
+        if summary.get('render_seconds') and self.video_duration:
+            fps = self.video_duration * FRAME_RATES[summary['quality']] / summary['render_seconds']
+            RENDER_FPS.observe(fps, quality=summary['quality'])
+            self.report.set(render_fps=round(fps, 2))
+        
+        if self.timing_report:
+            try:
+                self.report_file = self.report.write(os.path.splitext(final_file)[0] + ".timings.json")
+            except OSError as e:
+                print(f"Failed to write timing report: {str(e)}")
+
+def store_result(result_cache, key, prompt, generator, video_file):
+    """Add a finished run to the result cache and drop its leftover artifacts"""
+    artifacts = generator.artifacts()
+    try:
+        result_cache.put(
+            key, video_file,
+            code=artifacts['code'],
+            explanation=artifacts['explanation'],
+            voiceover_file=artifacts['voiceover_file'],
+            metadata={'prompt': prompt, 'model': llm_model_name(MODEL_NAME), 'quality': generator.quality,
+                      'version': PIPELINE_VERSION},
+        )
+    except OSError as e:
+        print(f"Failed to store result in cache: {str(e)}")
+    generator.cleanup_workspace(keep=[video_file])
+
+def load_batch(path):
+    """Read batch entries from JSONL; each line needs a prompt (or title) and may carry an id"""
+    entries = []
+    # Ids name the output file and key the manifest, so two entries whose
+    # ids sanitize to the same file name would overwrite each other's video
+    lines = {}
+    with open(path) as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            prompt = item.get('prompt') or item.get('title')
+            if not prompt:
+                raise ValueError(f"{path} line {index + 1} has no prompt")
+            entry_id = str(item.get('id') or item.get('request_id') or f"{index:04d}")
+            name = secure_name(entry_id).lower()
+            if name in lines:
+                raise ValueError(f"{path} line {index + 1} has id {entry_id!r}, which clashes with "
+                                 f"line {lines[name]}; batch ids must be unique file names")
+            lines[name] = index + 1
+            entries.append({'id': entry_id, 'prompt': prompt})
+    return entries
+
+def load_manifest(path):
+    """Latest manifest record per entry id (the manifest is append-only JSONL)"""
+    records = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave a truncated last line behind
+                    continue
+                records[record['id']] = record
+    return records
+
+def secure_name(entry_id):
+    """File name safe version of an entry id"""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', entry_id).strip('._') or "entry"
+
+def run_batch(input_path, output_dir, manifest_path=None, workers=None):
+    """Render every prompt of a JSONL file on a bounded pool of generators.
+    
+    Each finished entry is appended to the manifest right away, so after a
+    crash the next run skips entries whose video is already there.
+    Returns the number of entries that failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.jsonl")
+    workers = workers or int(os.getenv("JOB_WORKERS", "2"))
+    entries = load_batch(input_path)
+    done = load_manifest(manifest_path)
+    # Terminate a line cut short by a crash so new records start on a fresh line
+    if os.path.exists(manifest_path) and os.path.getsize(manifest_path):
+        with open(manifest_path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    pending = [
+        entry for entry in entries
+        if not (done.get(entry['id'], {}).get('status') == 'succeeded'
+                and os.path.exists(done[entry['id']]['output']))
+    ]
+    print(f"{len(entries) - len(pending)} of {len(entries)} entries already done, {len(pending)} to go")
+    
+    result_cache = result_cache_from_env()
+    quality = os.getenv("RENDER_QUALITY", "auto")
+    # One client for the whole batch: the scheduler and response cache are shared anyway
+    llm = create_llm_client(MODEL_NAME)
+    cancel_event = threading.Event()
+    manifest_lock = threading.Lock()
+    
+    def record(entry, **fields):
+        line = json.dumps(dict({'id': entry['id'], 'prompt': entry['prompt'], 'finished_at': time.time()}, **fields))
+        with manifest_lock:
+            with open(manifest_path, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def run_entry(entry):
+        output_path = os.path.join(output_dir, f"{secure_name(entry['id'])}.mp4")
+        started = time.perf_counter()
+        key = result_key(entry['prompt'], quality)
+        cached = result_cache.get(key) if result_cache else None
+        if cached:
+            shutil.copy2(cached['video'], output_path)
+            record(entry, status='succeeded', output=output_path, cached=True,
+                   seconds=round(time.perf_counter() - started, 3))
+            return True
+        
+        work_dir = tempfile.mkdtemp(prefix=".work_", dir=output_dir)
+        try:
+            generator = AnimationGenerator(work_dir=work_dir, cancel_event=cancel_event, quality=quality, llm=llm)
+            result = generator.process(entry['prompt'], output_path=output_path,
+                                       keep_artifacts=result_cache is not None)
+            if result and result_cache:
+                store_result(result_cache, key, entry['prompt'], generator, result)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if cancel_event.is_set():
+            return False
+        record(entry, status='succeeded' if result else 'failed', output=result, cached=False,
+               error=generator.error, seconds=round(time.perf_counter() - started, 3),
+               stage_timings=generator.stage_timings)
+        return bool(result)
+    
+    failures = 0
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    futures = {}
+    try:
+        futures = {executor.submit(run_entry, entry): entry for entry in pending}
+        for number, future in enumerate(as_completed(futures), 1):
+            entry = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                ok = False
+                record(entry, status='failed', output=None, error=str(e))
+            failures += not ok
+            print(f"[{number}/{len(pending)}] {entry['id']}: {'done' if ok else 'FAILED'}")
+    except KeyboardInterrupt:
+        # Running renders stop at their next check; completed entries are already in the manifest
+        cancel_event.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        raise
+    executor.shutdown()
+    print(f"Batch finished: {len(pending) - failures} succeeded, {failures} failed. Manifest: {manifest_path}")
+    return failures
+
+def run_single(prompt):
+    output_path = os.path.abspath("final_output.mp4")
+    
+    # Serve repeated prompts straight from the result cache
+    result_cache = result_cache_from_env()
+    key = result_key(prompt, os.getenv("RENDER_QUALITY", "auto"))
+    entry = result_cache.get(key) if result_cache else None
+    if entry:
+        shutil.copy2(entry['video'], output_path)
+        print(f"Cache hit! Final video saved as: {output_path}")
+        return 0
+    
+    generator = AnimationGenerator()
+    result = generator.process(prompt, output_path=output_path, keep_artifacts=result_cache is not None)
+    if result and result_cache:
+        store_result(result_cache, key, prompt, generator, result)
+    
+    if not result:
+        print("Failed to generate animation. Please check the error message.")
+        return 1
+    return 0
 
 if __name__ == "__main__":
     try:
         # Check if a command line argument was provided
         if len(sys.argv) < 2:
             print("Usage: python3 main.py \"explanation prompt\"")
+            print("       python3 main.py batch prompts.jsonl [--workers N] [--output-dir DIR] [--manifest FILE]")
             print("Example: python3 main.py \"Explain the Pythagorean theorem\"")
             sys.exit(1)
+        
+        if sys.argv[1] == "batch":
+            parser = argparse.ArgumentParser(prog="main.py batch",
+                                             description="Render every prompt of a JSONL file")
+            parser.add_argument('input', help="JSONL file with one {\"prompt\": ...} (or title) per line")
+            parser.add_argument('--workers', type=int, help="videos rendered at once (default: JOB_WORKERS or 2)")
+            parser.add_argument('--output-dir', default="batch_output", help="where videos and the manifest go")
+            parser.add_argument('--manifest', help="manifest path (default: <output-dir>/manifest.jsonl)")
+            args = parser.parse_args(sys.argv[2:])
+            sys.exit(1 if run_batch(args.input, os.path.abspath(args.output_dir), args.manifest, args.workers) else 0)
             
         # Combine all arguments after the script name as the prompt
-        prompt = " ".join(sys.argv[1:])
-        
-        generator = AnimationGenerator()
-        result = generator.process(prompt)
-        
-        if not result:
-            print("Failed to generate animation. Please check the error message.")
-            sys.exit(1)
+        sys.exit(run_single(" ".join(sys.argv[1:])))
             
     except KeyboardInterrupt:
         print("\nOperation cancelled by user")
@@ -0,0 +1,422 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Frames per second of Manim's quality presets, used to derive render throughput
+FRAME_RATES = {'-ql': 15, '-qm': 30, '-qh': 60}
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(4 ** n for n in range(5, 16))
+FPS_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 240)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Gauge:
+    """Current value read from a callback at scrape time"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, callback, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        registry.register(self)
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [] if value is None else [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets, optionally split by labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=SECONDS_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.series = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        if value is None:
+            return
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.series[key] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self.series.items()}
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    return REGISTRY.render()
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where it cannot be read"""
+    if resource is None:
+        return None
+    return rusage_peak_bytes(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def rusage_peak_bytes(usage):
+    # Linux reports ru_maxrss in kilobytes, macOS in bytes
+    return usage.ru_maxrss if os.uname().sysname == 'Darwin' else usage.ru_maxrss * 1024
+
+
+def rusage_write_bytes(usage):
+    # ru_oublock counts 512-byte blocks written to storage
+    return usage.ru_oublock * 512
+
+
+def write_bytes():
+    """Bytes this process itself has caused to be written to storage, or None off Linux.
+
+    Children are not included; writes to tmpfs never reach storage and are
+    not counted either.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+STAGE_SECONDS = Histogram('text2mathvideo_stage_seconds', 'Wall time of pipeline stages', ['stage'])
+STAGE_CPU_SECONDS = Histogram('text2mathvideo_stage_cpu_seconds',
+                              'CPU time spent in the pipeline stage thread itself', ['stage'])
+STAGES = Counter('text2mathvideo_stages_total', 'Pipeline stages run, by outcome', ['stage', 'status'])
+PROCESS_SECONDS = Histogram('text2mathvideo_subprocess_seconds', 'Wall time of external commands', ['command'])
+PROCESS_CPU_SECONDS = Histogram('text2mathvideo_subprocess_cpu_seconds',
+                                'User plus system CPU time of external commands', ['command'])
+PROCESS_PEAK_RSS = Histogram('text2mathvideo_subprocess_peak_rss_bytes',
+                             'Peak resident memory of external commands', ['command'], buckets=BYTES_BUCKETS)
+PROCESS_WRITE_BYTES = Histogram('text2mathvideo_subprocess_write_bytes',
+                                'Bytes external commands wrote to storage', ['command'], buckets=BYTES_BUCKETS)
+PROCESSES = Counter('text2mathvideo_subprocesses_total', 'External commands run, by outcome',
+                    ['command', 'status'])
+LLM_SECONDS = Histogram('text2mathvideo_llm_request_seconds', 'LLM call latency, including retries and cache hits',
+                        ['kind'])
+LLM_PROMPT_BYTES = Histogram('text2mathvideo_llm_prompt_bytes', 'Size of prompts sent to the LLM', ['kind'],
+                             buckets=BYTES_BUCKETS)
+LLM_RESPONSE_BYTES = Histogram('text2mathvideo_llm_response_bytes', 'Size of LLM responses', ['kind'],
+                               buckets=BYTES_BUCKETS)
+LLM_RETRIES = Counter('text2mathvideo_llm_retries_total', 'LLM calls retried after a transient error')
+RENDER_RETRIES = Counter('text2mathvideo_render_retries_total', 'Render attempts that failed, by reason',
+                         ['reason'])
+RENDER_FPS = Histogram('text2mathvideo_render_fps', 'Frames rendered per wall-clock second', ['quality'],
+                       buckets=FPS_BUCKETS)
+OUTPUT_BYTES = Histogram('text2mathvideo_output_bytes', 'Size of finished videos', buckets=BYTES_BUCKETS)
+JOBS = Counter('text2mathvideo_jobs_total', 'Pipeline runs, by outcome', ['status'])
+COALESCED_JOBS = Counter('text2mathvideo_jobs_coalesced_total',
+                         'Jobs that attached to an identical run already in flight')
+Gauge('text2mathvideo_process_peak_rss_bytes', 'Peak resident memory of the server process', peak_rss_bytes)
+
+
+class JobReport:
+    """Per-run record of the same measurements, written out as a JSON timing report"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {
+            'stages': {},
+            'subprocesses': [],
+            'llm_calls': [],
+            'render_retries': 0,
+        }
+
+    def add(self, section, entry):
+        with self.lock:
+            self.data[section].append(entry)
+
+    def set(self, **values):
+        with self.lock:
+            self.data.update(values)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.data[name] = self.data.get(name, 0) + amount
+
+    def to_dict(self):
+        with self.lock:
+            data = json.loads(json.dumps(self.data))
+        peaks = [entry['peak_rss_bytes'] for entry in data['subprocesses'] if entry.get('peak_rss_bytes')]
+        data['subprocess_peak_rss_bytes'] = max(peaks) if peaks else None
+        data['process_peak_rss_bytes'] = peak_rss_bytes()
+        return data
+
+    def write(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+def record_stages(timings, report=None):
+    """Record the per-stage timings returned by pipeline.run_stages"""
+    for name, timing in timings.items():
+        STAGE_SECONDS.observe(timing['duration'], stage=name)
+        STAGE_CPU_SECONDS.observe(timing.get('cpu'), stage=name)
+        STAGES.inc(stage=name, status=timing.get('status', 'ok'))
+    if report is not None:
+        report.set(stages=dict(timings))
+
+
+def record_process(name, wall, cpu=None, peak_rss=None, ok=True, report=None, written=None):
+    """Record one external command (or render worker task)"""
+    PROCESS_SECONDS.observe(wall, command=name)
+    PROCESS_CPU_SECONDS.observe(cpu, command=name)
+    PROCESS_PEAK_RSS.observe(peak_rss, command=name)
+    PROCESS_WRITE_BYTES.observe(written, command=name)
+    PROCESSES.inc(command=name, status='ok' if ok else 'failed')
+    if report is not None:
+        report.add('subprocesses', {
+            'command': name,
+            'seconds': round(wall, 3),
+            'cpu_seconds': round(cpu, 3) if cpu is not None else None,
+            'peak_rss_bytes': peak_rss,
+            'write_bytes': written,
+            'ok': ok,
+        })
+
+
+def record_llm_call(kind, seconds, prompt, response=None, report=None):
+    prompt_bytes = len(prompt.encode('utf-8'))
+    response_bytes = len(response.encode('utf-8')) if response is not None else None
+    LLM_SECONDS.observe(seconds, kind=kind)
+    LLM_PROMPT_BYTES.observe(prompt_bytes, kind=kind)
+    LLM_RESPONSE_BYTES.observe(response_bytes, kind=kind)
+    if report is not None:
+        report.add('llm_calls', {
+            'kind': kind,
+            'seconds': round(seconds, 3),
+            'prompt_bytes': prompt_bytes,
+            'response_bytes': response_bytes,
+        })
+
+
+def exit_code(status):
+    """Popen-style return code for a wait status: the exit code, or -signal when killed"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def wait_rusage(process, timeout=None):
+    """Reap a Popen child with os.wait4 and return its resource usage.
+
+    Popen.wait() and poll() reap through os.waitpid, which throws the rusage
+    away, so the child is waited for here and ``process.returncode`` is set
+    from the wait status. wait4 returns the usage of exactly this child, so
+    concurrent commands never mix up their CPU time or memory. Returns None
+    where wait4 is unavailable, and raises subprocess.TimeoutExpired like
+    Popen.wait().
+    """
+    if not hasattr(os, 'wait4'):
+        process.wait(timeout)
+        return None
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while process.returncode is None:
+        try:
+            pid, status, usage = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+        except ChildProcessError:
+            # Already reaped elsewhere; let Popen settle the return code
+            process.poll()
+            return None
+        if pid:
+            process.returncode = exit_code(status)
+            return usage
+        if time.monotonic() >= deadline:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        time.sleep(0.05)
+    return None
+
+
+class PipeReader:
+    """Feeds a child's stdin and reads its stdout and stderr on threads.
+
+    This is Popen.communicate() without the final wait, so the caller can
+    reap the child with wait_rusage() once the output is collected.
+    """
+
+    def __init__(self, process, input=None):
+        self.output = {}
+        self.threads = []
+        if process.stdin:
+            self._start(self._write, process.stdin, input)
+        for name in ('stdout', 'stderr'):
+            pipe = getattr(process, name)
+            if pipe:
+                self._start(self._read, name, pipe)
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _write(self, pipe, input):
+        try:
+            if input:
+                pipe.write(input)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+    def _read(self, name, pipe):
+        with pipe:
+            self.output[name] = pipe.read()
+
+    def join(self, timeout=None):
+        """Wait until the child closed its pipes; False if ``timeout`` ran out first"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                return False
+        return True
+
+    def result(self):
+        return self.output.get('stdout'), self.output.get('stderr')
+
+
+def record_popen(name, process, usage, started, report=None, ok_returncodes=(0,)):
+    """Record a reaped Popen child, its wait_rusage() usage and its start time (perf_counter)"""
+    cpu = usage.ru_utime + usage.ru_stime if usage else None
+    peak = rusage_peak_bytes(usage) if usage else None
+    written = rusage_write_bytes(usage) if usage else None
+    record_process(name, time.perf_counter() - started, cpu, peak, process.returncode in ok_returncodes, report,
+                   written)
+
+
+def run(name, args, input=None, capture_output=False, timeout=None, check=False, report=None, ok_returncodes=(0,),
+        **kwargs):
+    """subprocess.run() for a named external command that records its wall time, CPU time and peak RSS.
+
+    ``ok_returncodes`` lists the exit codes that count as success, for
+    commands that exit non-zero even when they did their job.
+    """
+    if capture_output:
+        kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    started = time.perf_counter()
+    process = subprocess.Popen(args, **kwargs)
+    usage = None
+    try:
+        pipes = PipeReader(process, input)
+        if not pipes.join(timeout):
+            raise subprocess.TimeoutExpired(args, timeout)
+        remaining = None if timeout is None else max(0, started + timeout - time.perf_counter())
+        usage = wait_rusage(process, remaining)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            usage = wait_rusage(process)
+        raise
+    finally:
+        record_popen(name, process, usage, started, report, ok_returncodes)
+    stdout, stderr = pipes.result()
+    if check and process.returncode not in ok_returncodes:
+        raise subprocess.CalledProcessError(process.returncode, args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
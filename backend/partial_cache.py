@@ -0,0 +1,163 @@
+import os
+import shutil
+import threading
+import uuid
+
+from cache import LRUDirectory, list_files
+
+# Manim deletes the oldest partial movies once a directory holds more than
+# max_files_cached files, so never seed more than fits under that limit
+MAX_FILES_CACHED = 1000
+SEED_LIMIT = 900
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class PartialMovieCache:
+    """Shared store of Manim partial movie files, keyed by Manim's animation hash.
+
+    Renders never write into the store directly. Before a render the store's
+    files are hard-linked into a private partial movie directory, so Manim
+    finds cached animations there; afterwards newly rendered files are linked
+    back into the store. Hard links make this safe under concurrent workers:
+    evicting a file from the store never breaks a render that already linked it.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.store = LRUDirectory(max_bytes, self.files, os.remove)
+
+    def store_dir(self, quality_flag):
+        path = os.path.join(self.root, quality_flag.lstrip('-'))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def seed(self, private_dir, quality_flag):
+        """Link the most recently used store files into a render's private directory"""
+        os.makedirs(private_dir, exist_ok=True)
+        store_dir = self.store_dir(quality_flag)
+        files = []
+        for name in os.listdir(store_dir):
+            if name.endswith('.mp4'):
+                try:
+                    files.append((os.path.getmtime(os.path.join(store_dir, name)), name))
+                except OSError:
+                    pass
+        seeded = set()
+        for _, name in sorted(files, reverse=True)[:SEED_LIMIT]:
+            try:
+                os.link(os.path.join(store_dir, name), os.path.join(private_dir, name))
+            except FileExistsError:
+                pass
+            except OSError:
+                # Store on another filesystem; a symlink is still good enough for reading
+                try:
+                    os.symlink(os.path.join(store_dir, name), os.path.join(private_dir, name))
+                except OSError:
+                    continue
+            seeded.add(name)
+        return seeded
+
+    def publish(self, private_dir, quality_flag, seeded, succeeded=True):
+        """Move newly rendered partial movies into the store and record hit/miss counts"""
+        if not os.path.isdir(private_dir):
+            return
+        store_dir = self.store_dir(quality_flag)
+
+        # Manim lists the partial movies it stitched together; that tells us
+        # which animations came from the store and which were rendered
+        used = []
+        list_file = os.path.join(private_dir, "partial_movie_file_list.txt")
+        if os.path.exists(list_file):
+            with open(list_file) as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith("file "):
+                        used.append(os.path.basename(line[5:].strip("'\"")))
+        hits = [name for name in used if name in seeded]
+        with self.lock:
+            self.hits += len(hits)
+            self.misses += len(used) - len(hits)
+        for name in hits:
+            try:
+                os.utime(os.path.join(store_dir, name))
+            except OSError:
+                pass
+
+        new_files = [
+            name for name in os.listdir(private_dir)
+            if name.endswith('.mp4') and name not in seeded
+            and not os.path.islink(os.path.join(private_dir, name))
+        ]
+        if not succeeded and new_files:
+            # The animation that was being written when Manim failed may be
+            # truncated, so leave the newest file out of the store
+            new_files.sort(key=lambda name: os.path.getmtime(os.path.join(private_dir, name)))
+            new_files.pop()
+        added = sum(self._add(os.path.join(private_dir, name), os.path.join(store_dir, name))
+                    for name in new_files)
+        if added:
+            self.store.added(added)
+
+    def _add(self, src, dest):
+        """Link or copy one file into the store, returning the bytes it added"""
+        if os.path.exists(dest):
+            return 0
+        try:
+            os.link(src, dest)
+        except FileExistsError:
+            return 0
+        except OSError:
+            # Copy under a temporary name so readers never see a partial file
+            tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+            try:
+                shutil.copy2(src, tmp)
+                os.replace(tmp, dest)
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return 0
+        try:
+            return os.path.getsize(dest)
+        except OSError:
+            return 0
+
+    def files(self):
+        """List (last_use, size, path) for every partial movie in the store"""
+        return list_files(self.root, '.mp4')
+
+    def evict(self):
+        """Delete least recently used partial movies until the store fits its byte budget"""
+        self.store.evict()
+
+    def stats(self):
+        files, size = self.store.usage()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'files': files,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+def get_partial_cache():
+    """Process-wide partial movie cache, or None when PARTIAL_CACHE_MAX_BYTES is 0"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            max_bytes = int(os.getenv("PARTIAL_CACHE_MAX_BYTES", str(1024 ** 3)))
+            if max_bytes <= 0:
+                return None
+            root = os.getenv("PARTIAL_CACHE_DIR", os.path.join(
+                os.path.expanduser("~"), ".cache", "text2mathvideo", "partial_movies"))
+            _cache = PartialMovieCache(root, max_bytes)
+        return _cache
@@ -0,0 +1,97 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+    """A pipeline step that runs once all of its dependencies have finished"""
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+def run_stages(stages, check=None, timings=None, on_error=None):
+    """Run a dependency graph of stages, starting each one as soon as its inputs are ready.
+
+    Each stage function is called with the results of its dependencies, in the
+    order they are listed. Returns a ``(results, timings)`` pair where timings
+    hold start/end offsets (seconds since the graph started), the CPU time of
+    the stage's own thread and an ok/failed status for every stage. Pass a
+    ``timings`` dict to still see them when the graph raises.
+    The optional ``check`` callable runs before each stage is started and may
+    raise to abort the remaining stages. The optional ``on_error`` callable is
+    called with the first failure, so stages that are still running can be
+    told to stop early.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    results = {}
+    timings = {} if timings is None else timings
+    pending = list(stages)
+    running = {}
+    error = None
+    t0 = time.perf_counter()
+
+    def execute(stage, args):
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        status = 'failed'
+        try:
+            result = stage.func(*args)
+            status = 'ok'
+            return result
+        finally:
+            end = time.perf_counter()
+            timings[stage.name] = {
+                'start': round(start - t0, 3),
+                'end': round(end - t0, 3),
+                'duration': round(end - start, 3),
+                'cpu': round(time.thread_time() - cpu_start, 3),
+                'status': status,
+            }
+
+    with ThreadPoolExecutor(max_workers=max(len(stages), 1), thread_name_prefix="stage") as executor:
+        while pending or running:
+            # Launch every stage whose dependencies are all satisfied
+            if error is None:
+                for stage in list(pending):
+                    if all(dep in results for dep in stage.deps):
+                        try:
+                            if check is not None:
+                                check()
+                        except Exception as e:
+                            error = e
+                            if on_error is not None:
+                                on_error(e)
+                            break
+                        pending.remove(stage)
+                        args = [results[dep] for dep in stage.deps]
+                        running[executor.submit(execute, stage, args)] = stage
+            if error is not None:
+                pending = []
+            if not running:
+                if pending:
+                    raise ValueError("Stage graph has a dependency cycle")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception as e:
+                    # Keep the first failure; stages already running are waited
+                    # for so they do not race with the caller's cleanup
+                    if error is None:
+                        error = e
+                        if on_error is not None:
+                            on_error(e)
+
+    if error is not None:
+        raise error
+    return results, timings
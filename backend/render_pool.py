@@ -0,0 +1,214 @@
+import atexit
+import importlib.util
+import multiprocessing
+import os
+import signal
+import threading
+import traceback
+import uuid
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Manim's named quality presets for the CLI quality flags
+QUALITY_NAMES = {
+    '-ql': 'low_quality',
+    '-qm': 'medium_quality',
+    '-qh': 'high_quality',
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RenderError(RuntimeError):
+    """Raised when Manim fails to render a scene; the message is Manim's error output"""
+
+
+class RenderCancelled(RuntimeError):
+    """Raised when a render is cancelled; its worker process has been stopped by then"""
+
+
+def _cpu_seconds():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _write_bytes():
+    """Storage writes of this worker and the processes it has reaped (ffmpeg, LaTeX)"""
+    from metrics import rusage_write_bytes, write_bytes
+
+    own = write_bytes()
+    if own is None or resource is None:
+        return None
+    return own + rusage_write_bytes(resource.getrusage(resource.RUSAGE_CHILDREN))
+
+
+def _render(script_file, scene_name, quality_flag, media_dir, output_name, animation_range,
+            partial_movie_dir):
+    """Render one scene inside a worker process with an explicit per-job config"""
+    from manim import tempconfig
+    from metrics import peak_rss_bytes
+    from partial_cache import MAX_FILES_CACHED
+
+    options = {
+        'quality': QUALITY_NAMES[quality_flag],
+        'media_dir': media_dir,
+        'input_file': script_file,
+        'output_file': output_name,
+        'disable_caching': partial_movie_dir is None,
+        'write_to_movie': True,
+        'progress_bar': 'none',
+    }
+    if partial_movie_dir:
+        options['partial_movie_dir'] = partial_movie_dir
+        options['max_files_cached'] = MAX_FILES_CACHED
+    if animation_range:
+        options['from_animation_number'] = animation_range[0]
+        if len(animation_range) > 1:
+            options['upto_animation_number'] = animation_range[1]
+
+    cpu_start = _cpu_seconds()
+    written_start = _write_bytes()
+    try:
+        with tempconfig(options):
+            # Load the generated module under a unique name so successive jobs
+            # in the same worker never see each other's classes
+            spec = importlib.util.spec_from_file_location(f"scene_{uuid.uuid4().hex}", script_file)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            scene = getattr(module, scene_name)()
+            scene.render()
+
+            path = str(scene.renderer.file_writer.movie_file_path or '')
+            return {
+                'ok': True,
+                # Ranges past the end of the scene legitimately produce no file
+                'path': path if path and os.path.exists(path) else None,
+                'duration': getattr(scene.renderer, 'time', None),
+                # The worker's own usage, since the parent cannot see it per task
+                'cpu_seconds': _cpu_seconds() - cpu_start if cpu_start is not None else None,
+                'peak_rss_bytes': peak_rss_bytes(),
+                # Partial movies and the output file; the parent cannot see
+                # these since workers are children of the fork server
+                'write_bytes': _write_bytes() - written_start if written_start is not None else None,
+            }
+    except Exception:
+        return {'ok': False, 'error': traceback.format_exc()}
+
+
+def _render_process(connection, args):
+    """Worker process entry point: render, send the result back and exit"""
+    # Lead a process group of our own so stopping the render also stops any
+    # ffmpeg or LaTeX process Manim started
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    try:
+        result = _render(*args)
+    except BaseException:
+        result = {'ok': False, 'error': traceback.format_exc()}
+    connection.send(result)
+    connection.close()
+
+
+class RenderPool:
+    """Renders Manim scenes in worker processes that start with Manim already imported.
+
+    Every render runs in a process of its own, forked from a server that
+    imported Manim once, so a cancelled render is stopped by terminating its
+    process and no memory builds up across jobs. At most ``processes``
+    renders run at once; the rest wait for a free slot.
+    """
+
+    def __init__(self, processes=None):
+        methods = multiprocessing.get_all_start_methods()
+        if 'forkserver' in methods:
+            # Workers fork from a server that already imported Manim, and the
+            # web app's own module is never re-imported in the children
+            self.context = multiprocessing.get_context('forkserver')
+            self.context.set_forkserver_preload(['manim', 'render_pool'])
+        else:
+            # Without a fork server every render pays for importing Manim
+            self.context = multiprocessing.get_context('spawn')
+        self.slots = threading.BoundedSemaphore(processes or os.cpu_count() or 1)
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def render(self, script_file, quality_flag, media_dir, output_name,
+               animation_range=None, partial_movie_dir=None, scene_name="ExplanationScene",
+               should_stop=None):
+        """Render a scene and return {'path', 'duration', ...}; raises RenderError on failure.
+
+        ``should_stop`` is polled while waiting; once it returns True the worker
+        process is terminated and RenderCancelled is raised, so nothing keeps
+        rendering (or writing into ``media_dir``) after the call returns.
+        """
+        # Wait for a free slot, giving up if the caller is cancelled meanwhile
+        while not self.slots.acquire(timeout=0.5):
+            if should_stop is not None and should_stop():
+                raise RenderCancelled("Render was cancelled")
+        try:
+            receiver, sender = self.context.Pipe(duplex=False)
+            process = self.context.Process(
+                target=_render_process, daemon=True,
+                args=(sender, (script_file, scene_name, quality_flag, media_dir, output_name, animation_range,
+                               partial_movie_dir)),
+            )
+            with self.lock:
+                process.start()
+                self.processes.add(process)
+            sender.close()
+            try:
+                while not receiver.poll(0.5):
+                    if should_stop is not None and should_stop():
+                        self.stop(process)
+                        raise RenderCancelled("Render was cancelled")
+                    if not process.is_alive() and not receiver.poll():
+                        raise RenderError(f"Render worker exited with code {process.exitcode}")
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    process.join()
+                    raise RenderError(f"Render worker exited with code {process.exitcode}")
+                process.join()
+            finally:
+                receiver.close()
+                with self.lock:
+                    self.processes.discard(process)
+        finally:
+            self.slots.release()
+        if not result['ok']:
+            raise RenderError(result['error'])
+        return result
+
+    def stop(self, process, timeout=5):
+        """Terminate a worker and everything it started, and wait for it to exit"""
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except (AttributeError, OSError):
+            # No process groups here, or the worker has not created its group yet
+            process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def close(self):
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            self.stop(process)
+
+
+def get_render_pool():
+    """Process-wide render pool running at most RENDER_WORKERS renders at once"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool(processes=int(os.getenv("RENDER_WORKERS", "0")) or None)
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,552 @@
+import ast
+import math
+import re
+
+SCENE_CLASS = "ExplanationScene"
+
+# Manim's DEFAULT_ANIMATION_RUN_TIME and the default of Scene.wait()
+DEFAULT_RUN_TIME = 1.0
+DEFAULT_WAIT = 1.0
+
+# Default run times of the animations the analyzer knows; any other class
+# is timed at DEFAULT_RUN_TIME and marks the timeline as estimated
+RUN_TIME_DEFAULTS = {
+    'Create': 1.0, 'Uncreate': 1.0, 'DrawBorderThenFill': 2.0, 'ShowIncreasingSubsets': 1.0,
+    'FadeIn': 1.0, 'FadeOut': 1.0, 'FadeTransform': 1.0, 'FadeToColor': 1.0,
+    'GrowFromCenter': 1.0, 'GrowFromPoint': 1.0, 'GrowFromEdge': 1.0, 'GrowArrow': 1.0,
+    'SpinInFromNothing': 1.0, 'ShrinkToCenter': 1.0, 'ScaleInPlace': 1.0,
+    'Transform': 1.0, 'ReplacementTransform': 1.0, 'TransformFromCopy': 1.0, 'ClockwiseTransform': 1.0,
+    'CounterclockwiseTransform': 1.0, 'MoveToTarget': 1.0, 'ApplyMethod': 1.0, 'ApplyMatrix': 1.0,
+    'ApplyFunction': 1.0, 'Restore': 1.0, 'CyclicReplace': 1.0, 'Swap': 1.0,
+    'TransformMatchingShapes': 1.0, 'TransformMatchingTex': 1.0, 'Rotate': 1.0, 'MoveAlongPath': 1.0,
+    'Indicate': 1.0, 'Flash': 1.0, 'Circumscribe': 1.0, 'ShowPassingFlash': 1.0, 'FocusOn': 2.0,
+    'Wiggle': 2.0, 'ApplyWave': 2.0, 'Rotating': 5.0, 'Homotopy': 3.0, 'ApplyPointwiseFunction': 3.0,
+    'Broadcast': 3.0,
+}
+# Scene methods that change what is on screen without taking any time;
+# calls to any other self.<method> the analyzer cannot follow (wait_until,
+# move_camera, ...) mark the timeline as estimated
+UNTIMED_SCENE_METHODS = {
+    'add', 'remove', 'clear', 'bring_to_front', 'bring_to_back', 'add_foreground_mobject',
+    'add_foreground_mobjects', 'remove_foreground_mobject', 'remove_foreground_mobjects',
+    'add_updater', 'remove_updater', 'add_sound', 'add_subcaption', 'next_section',
+    'set_camera_orientation', 'begin_ambient_camera_rotation', 'stop_ambient_camera_rotation',
+}
+# Animations whose default run time depends on the mobject (Write takes 1 s
+# or 2 s depending on its length), so a missing run_time is only a guess
+RUN_TIME_VARIES = {'Write', 'Unwrite', 'AddTextLetterByLetter', 'AddTextWordByWord', 'RemoveTextLetterByLetter'}
+GROUPS = {'AnimationGroup', 'LaggedStart', 'LaggedStartMap', 'Succession'}
+DEFAULT_LAG_RATIOS = {'AnimationGroup': 0.0, 'LaggedStart': 0.05, 'LaggedStartMap': 0.05, 'Succession': 1.0}
+
+# Loops longer than this are not unrolled; their body is timed once and scaled
+MAX_UNROLL = 200
+# Statements walked per scene; past this, loops time their remaining passes
+# like the last one instead of unrolling them (nested loops multiply up)
+MAX_STEPS = 5000
+# Largest list, range or string the evaluator builds, largest exponent it
+# computes and largest integer (in bits) it keeps
+MAX_ITEMS = 10000
+MAX_EXPONENT = 64
+MAX_INT_BITS = 256
+MAX_CALL_DEPTH = 8
+
+CONSTANTS = {'PI': math.pi, 'TAU': math.tau, 'DEGREES': math.pi / 180, 'pi': math.pi}
+FUNCTIONS = {'min': min, 'max': max, 'abs': abs, 'int': int, 'float': float, 'round': round, 'len': len}
+OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a ** b,
+}
+
+
+class Unknown(Exception):
+    """An expression whose value cannot be worked out statically"""
+
+
+def evaluate(node, env):
+    """Evaluate a constant expression (numbers, known names, arithmetic, ranges and lists)"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in env:
+            return env[node.id]
+        if node.id in CONSTANTS:
+            return CONSTANTS[node.id]
+        raise Unknown(node.id)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = evaluate(node.operand, env)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        return arithmetic(node.op, evaluate(node.left, env), evaluate(node.right, env))
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [evaluate(item, env) for item in node.elts]
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        args = [evaluate(arg, env) for arg in node.args]
+        if node.func.id == 'range':
+            # Kept lazy: only its length matters until a loop unrolls it
+            try:
+                items = range(*[int(arg) for arg in args])
+                len(items)  # Raises OverflowError past sys.maxsize
+                return items
+            except (TypeError, ValueError, OverflowError):
+                raise Unknown('range')
+        if any(isinstance(arg, range) and len(arg) > MAX_ITEMS for arg in args):
+            raise Unknown(node.func.id)
+        if node.func.id == 'enumerate' and len(args) == 1:
+            try:
+                return list(enumerate(args[0]))
+            except TypeError:
+                raise Unknown('enumerate')
+        if node.func.id in FUNCTIONS:
+            try:
+                return FUNCTIONS[node.func.id](*args)
+            except (TypeError, ValueError, ArithmeticError):
+                # int(), round() and float() of inf, nan or huge numbers
+                raise Unknown(node.func.id)
+    raise Unknown(type(node).__name__)
+
+
+def arithmetic(op, left, right):
+    """Apply a binary operator to evaluated operands, refusing huge operands and results"""
+    if type(op) not in OPERATORS:
+        raise Unknown(type(op).__name__)
+    check_size(op, left, right)
+    try:
+        value = OPERATORS[type(op)](left, right)
+    except (TypeError, ValueError, ArithmeticError):
+        raise Unknown("arithmetic")
+    if isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+        # Keeps chains like x **= 64 from growing without bound
+        raise Unknown("integer size")
+    return value
+
+
+def check_size(op, left, right):
+    """Refuse arithmetic whose result would be huge (``[0] * 10**9``, ``10**10**10``)"""
+    if any(isinstance(value, int) and value.bit_length() > MAX_INT_BITS for value in (left, right)):
+        raise Unknown("integer size")
+    sequences = (list, str, range)
+    if isinstance(left, sequences) or isinstance(right, sequences):
+        if isinstance(op, ast.Mult):
+            sequence, times = (left, right) if isinstance(left, sequences) else (right, left)
+            if not isinstance(times, int) or len(sequence) * times > MAX_ITEMS:
+                raise Unknown("sequence size")
+        elif isinstance(op, ast.Add) and isinstance(left, sequences) and isinstance(right, sequences):
+            if len(left) + len(right) > MAX_ITEMS:
+                raise Unknown("sequence size")
+    elif isinstance(op, ast.Pow) and isinstance(right, (int, float)) and abs(right) > MAX_EXPONENT:
+        raise Unknown("exponent")
+
+
+def keyword(call, name):
+    for kw in call.keywords:
+        if kw.arg == name:
+            return kw.value
+    return None
+
+
+def call_name(call):
+    func = call.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+
+class SceneAnalyzer:
+    """Walks a scene's construct() in execution order, timing every play and wait"""
+
+    def __init__(self, code, tree, methods, functions):
+        self.code = code
+        self.tree = tree
+        self.methods = methods
+        self.functions = functions
+        self.events = []
+        self.time = 0.0
+        self.exact = True
+        self.depth = 0
+        self.steps = 0
+        # Module level names, and the name the scene goes by in the current helper
+        self.globals = {}
+        self.scene_name = 'self'
+
+    def scene_method(self, call):
+        """Name of the scene method a call invokes (``self.play(...)`` -> 'play'), or None"""
+        func = call.func
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) \
+                and func.value.id == self.scene_name:
+            return func.attr
+        return None
+
+    def source(self, node, limit=80):
+        text = ast.get_source_segment(self.code, node) or ''
+        text = ' '.join(text.split())
+        return text if len(text) <= limit else text[:limit - 3] + '...'
+
+    def value(self, node, env, default):
+        """Evaluate a duration expression, falling back to ``default`` and marking the timeline inexact"""
+        try:
+            value = evaluate(node, env)
+            if isinstance(value, (int, float)) and math.isfinite(value):
+                return float(value)
+        except (Unknown, ArithmeticError):
+            pass
+        self.exact = False
+        return default
+
+    def animation_time(self, node, env):
+        """Run time of one animation passed to self.play()"""
+        if isinstance(node, ast.Starred):
+            # self.play(*[FadeOut(m) for m in ...]) plays the animations together
+            node = node.value
+            if isinstance(node, ast.ListComp):
+                node = node.elt
+        if not isinstance(node, ast.Call):
+            # Names bound to animations or .animate chains: Manim's default
+            if not self.is_animate_chain(node):
+                self.exact = False
+            return DEFAULT_RUN_TIME
+
+        run_time = keyword(node, 'run_time')
+        if run_time is not None:
+            return self.value(run_time, env, DEFAULT_RUN_TIME)
+        name = call_name(node)
+        if name in GROUPS:
+            children = [self.animation_time(arg, env) for arg in node.args]
+            if not children:
+                return 0.0
+            lag_node = keyword(node, 'lag_ratio')
+            lag = self.value(lag_node, env, 0.0) if lag_node is not None else DEFAULT_LAG_RATIOS[name]
+            # Child i starts once lag * (duration of child i-1) has passed
+            start = end = 0.0
+            for duration in children:
+                end = max(end, start + duration)
+                start += lag * duration
+            return end
+        animate = self.animate_call(node)
+        if animate is not None:
+            # mobject.animate(run_time=..., rate_func=...).shift(...)
+            run_time = keyword(animate, 'run_time')
+            if run_time is not None:
+                return self.value(run_time, env, DEFAULT_RUN_TIME)
+            if animate.args or animate.keywords:
+                self.exact = False
+            return DEFAULT_RUN_TIME
+        if self.is_animate_chain(node):
+            return DEFAULT_RUN_TIME
+        if name in RUN_TIME_VARIES or name not in RUN_TIME_DEFAULTS:
+            self.exact = False
+        return RUN_TIME_DEFAULTS.get(name, DEFAULT_RUN_TIME)
+
+    def animate_call(self, node):
+        """The ``<mobject>.animate(...)`` call of an animate chain, if it has one"""
+        while True:
+            if isinstance(node, ast.Call):
+                if isinstance(node.func, ast.Attribute) and node.func.attr == 'animate':
+                    return node
+                node = node.func
+            elif isinstance(node, ast.Attribute):
+                node = node.value
+            else:
+                return None
+
+    def is_animate_chain(self, node):
+        """Whether the expression is built on ``<mobject>.animate``"""
+        while True:
+            if isinstance(node, ast.Attribute):
+                if node.attr == 'animate':
+                    return True
+                node = node.value
+            elif isinstance(node, ast.Call):
+                node = node.func
+            else:
+                return False
+
+    def add(self, kind, node, duration):
+        self.events.append({
+            'type': kind,
+            'content': self.source(node),
+            'line': node.lineno,
+            'start': round(self.time, 3),
+            'duration': round(duration, 3),
+        })
+        self.time += duration
+
+    def visit_call(self, call, env):
+        method = self.scene_method(call)
+        if method == 'play':
+            run_time = keyword(call, 'run_time')
+            if run_time is not None:
+                duration = self.value(run_time, env, DEFAULT_RUN_TIME)
+            else:
+                durations = [self.animation_time(arg, env) for arg in call.args]
+                duration = max(durations) if durations else 0.0
+            self.add('play', call, duration)
+        elif method in ('wait', 'pause'):
+            duration_node = call.args[0] if call.args else keyword(call, 'duration')
+            duration = self.value(duration_node, env, DEFAULT_WAIT) if duration_node is not None else DEFAULT_WAIT
+            self.add('wait', call, duration)
+        elif method in self.methods:
+            self.inline(self.methods[method], call, env, skip_self=True)
+        elif isinstance(call.func, ast.Name) and call.func.id in self.functions:
+            # Module level helpers usually take the scene as an argument
+            self.inline(self.functions[call.func.id], call, env, skip_self=False)
+        else:
+            if method is not None and method not in UNTIMED_SCENE_METHODS:
+                self.exact = False
+            # Arguments may themselves call helpers, e.g. group = VGroup(self.make_axes())
+            for arg in list(call.args) + [kw.value for kw in call.keywords]:
+                self.visit_expression(arg, env)
+
+    def visit_expression(self, node, env):
+        if isinstance(node, ast.Call):
+            self.visit_call(node, env)
+        elif isinstance(node, (ast.Lambda, ast.ListComp, ast.GeneratorExp, ast.DictComp, ast.SetComp)):
+            # Lambdas (updaters, always_redraw) run per frame, not as scene steps
+            return
+        else:
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, ast.expr):
+                    self.visit_expression(child, env)
+
+    def inline(self, function, call, env, skip_self):
+        """Walk a helper's body as if it were written at the call site"""
+        if self.depth >= MAX_CALL_DEPTH:
+            self.exact = False
+            return
+        params = [arg.arg for arg in function.args.args]
+        scene_name = None
+        if skip_self and params:
+            scene_name = params[0]
+            params = params[1:]
+        else:
+            for name, arg in zip(params, call.args):
+                if isinstance(arg, ast.Name) and arg.id == self.scene_name:
+                    scene_name = name
+        local = dict(self.globals)
+        defaults = function.args.defaults
+        for name, default in zip(params[len(params) - len(defaults):], defaults):
+            try:
+                local[name] = evaluate(default, env)
+            except Unknown:
+                pass
+        for name, arg in zip(params, call.args):
+            try:
+                local[name] = evaluate(arg, env)
+            except Unknown:
+                local.pop(name, None)
+        for kw in call.keywords:
+            if kw.arg in params:
+                try:
+                    local[kw.arg] = evaluate(kw.value, env)
+                except Unknown:
+                    local.pop(kw.arg, None)
+        outer_scene_name = self.scene_name
+        self.scene_name = scene_name
+        self.depth += 1
+        try:
+            self.visit_body(function.body, local)
+        except ReturnFromHelper:
+            pass
+        finally:
+            self.depth -= 1
+            self.scene_name = outer_scene_name
+
+    def visit_body(self, body, env):
+        for statement in body:
+            self.visit_statement(statement, env)
+
+    def visit_statement(self, node, env):
+        self.steps += 1
+        if isinstance(node, ast.Expr):
+            self.visit_expression(node.value, env)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            if node.value is not None:
+                self.visit_expression(node.value, env)
+                self.bind(node, env)
+        elif isinstance(node, ast.For):
+            self.visit_for(node, env)
+        elif isinstance(node, ast.While):
+            # The iteration count is unknown: time the body once
+            self.exact = False
+            self.visit_body(node.body, env)
+        elif isinstance(node, ast.If):
+            try:
+                branch = node.body if evaluate(node.test, env) else node.orelse
+            except Unknown:
+                self.exact = False
+                branch = node.body
+            self.visit_body(branch, env)
+        elif isinstance(node, ast.With):
+            self.visit_body(node.body, env)
+        elif isinstance(node, ast.Try):
+            self.visit_body(node.body, env)
+            self.visit_body(node.orelse, env)
+            self.visit_body(node.finalbody, env)
+        elif isinstance(node, ast.Return):
+            if node.value is not None:
+                self.visit_expression(node.value, env)
+            if self.depth:
+                raise ReturnFromHelper()
+
+    def bind(self, node, env):
+        """Track simple numeric assignments so later run_time=/wait() arguments resolve"""
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        for target in targets:
+            if not isinstance(target, ast.Name):
+                continue
+            try:
+                if isinstance(node, ast.AugAssign):
+                    value = arithmetic(node.op, env[target.id], evaluate(node.value, env))
+                else:
+                    value = evaluate(node.value, env)
+                env[target.id] = value
+            except (Unknown, KeyError, ArithmeticError):
+                env.pop(target.id, None)
+
+    def visit_for(self, node, env):
+        try:
+            items = evaluate(node.iter, env)
+        except Unknown:
+            items = None
+        if items is not None and not isinstance(items, (list, tuple, str, range)):
+            items = None
+        if items is None or len(items) > MAX_UNROLL:
+            # Time one pass and count the rest as a single repeat event, when
+            # at least the length is known; either way the result is a guess
+            self.exact = False
+            count = len(items) if items is not None else 1
+            start = len(self.events)
+            self.visit_body(node.body, dict(env))
+            body = sum(event['duration'] for event in self.events[start:])
+            if count > 1 and body:
+                self.add('repeat', node, body * (count - 1))
+            return
+        for index, item in enumerate(items):
+            if index and self.steps > MAX_STEPS:
+                # Out of budget: count the remaining passes like the last one
+                self.exact = False
+                if last:
+                    self.add('repeat', node, last * (len(items) - index))
+                break
+            start = len(self.events)
+            if isinstance(node.target, ast.Name):
+                env[node.target.id] = item
+            elif isinstance(node.target, ast.Tuple) and isinstance(item, (list, tuple)) \
+                    and len(item) == len(node.target.elts):
+                for element, value in zip(node.target.elts, item):
+                    if isinstance(element, ast.Name):
+                        env[element.id] = value
+            self.visit_body(node.body, env)
+            last = sum(event['duration'] for event in self.events[start:])
+        self.visit_body(node.orelse, env)
+
+
+class ReturnFromHelper(Exception):
+    """Stops walking a helper at its return statement"""
+
+
+def find_scene(tree, scene_class):
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == scene_class:
+            return node
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and any(
+                (getattr(base, 'id', None) or getattr(base, 'attr', '')).endswith('Scene') for base in node.bases):
+            return node
+    return None
+
+
+def group_segments(events):
+    """Fold every wait into the play before it, giving one segment per visual step"""
+    segments = []
+    for event in events:
+        if event['type'] in ('wait', 'repeat') and segments:
+            segments[-1]['duration'] = round(segments[-1]['duration'] + event['duration'], 3)
+            segments[-1]['end'] = round(event['start'] + event['duration'], 3)
+            continue
+        segments.append({
+            'type': 'animation' if event['type'] == 'play' else 'wait',
+            'content': event['content'],
+            'line': event['line'],
+            'start': event['start'],
+            'end': round(event['start'] + event['duration'], 3),
+            'duration': event['duration'],
+        })
+    return segments
+
+
+def regex_timeline(code):
+    """Crude fallback for code that does not parse: one second per play, literal waits"""
+    events = []
+    time = 0.0
+    for match in re.finditer(r'self\.(play|wait)\(([^)]*)\)', code):
+        duration = DEFAULT_RUN_TIME
+        if match.group(1) == 'wait':
+            try:
+                duration = float(match.group(2) or DEFAULT_WAIT)
+            except ValueError:
+                pass
+        events.append({'type': match.group(1), 'content': match.group(0)[:80],
+                       'line': code.count('\n', 0, match.start()) + 1, 'start': round(time, 3),
+                       'duration': duration})
+        time += duration
+    return events
+
+
+def ast_timeline(code, scene_class):
+    """(events, exact) from walking the scene's construct() in the parsed code"""
+    tree = ast.parse(code)
+    scene = find_scene(tree, scene_class)
+    methods = {}
+    if scene is not None:
+        methods = {item.name: item for item in scene.body if isinstance(item, ast.FunctionDef)}
+    functions = {node.name: node for node in tree.body if isinstance(node, ast.FunctionDef)}
+    analyzer = SceneAnalyzer(code, tree, methods, functions)
+    # Module level numeric constants are visible inside every method and helper
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            analyzer.bind(node, analyzer.globals)
+    if 'construct' not in methods:
+        return [], False
+    analyzer.inline(methods['construct'], ast.Call(func=None, args=[], keywords=[]), {}, skip_self=True)
+    return analyzer.events, analyzer.exact
+
+
+def analyze_scene(code, scene_class=SCENE_CLASS):
+    """Timeline of a Manim scene from its source.
+
+    Returns a dict with the play/wait ``events`` in execution order (each is
+    one Manim animation number), the ``segments`` they form (every wait
+    folded into the play before it), the total ``duration`` in seconds and
+    whether every duration was resolved ``exact``-ly rather than guessed.
+    """
+    try:
+        events, exact = ast_timeline(code, scene_class)
+    except (SyntaxError, ValueError, ArithmeticError, RecursionError, MemoryError):
+        # Unparsable code, code too deeply nested to walk, or arithmetic the
+        # evaluator failed to contain
+        events = regex_timeline(code)
+        exact = False
+
+    duration = sum(event['duration'] for event in events)
+    return {
+        'events': events,
+        'segments': group_segments(events),
+        'duration': round(duration, 3),
+        'exact': exact,
+    }
+
+
+def format_timeline(timeline):
+    """Human readable timeline for the explanation prompt"""
+    lines = [f"[{segment['start']:.1f}s-{segment['end']:.1f}s] {segment['content']}"
+             for segment in timeline['segments']]
+    note = "exact" if timeline['exact'] else "estimated"
+    lines.append(f"Total: {timeline['duration']:.1f}s ({note})")
+    return '\n'.join(lines)
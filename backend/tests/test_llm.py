@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from llm import (CODE, FIX, HTTPLLMClient, LLMScheduler, RetryableLLMError, ScheduledLLMClient, TokenBucket,
+                 llm_model_name)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSleep:
+    """Records the requested delays instead of sleeping"""
+
+    def __init__(self):
+        self.delays = []
+
+    def __call__(self, seconds):
+        self.delays.append(seconds)
+
+
+def make_scheduler(**kwargs):
+    sleep = FakeSleep()
+    scheduler = LLMScheduler(clock=FakeClock(), sleep=sleep, **kwargs)
+    return scheduler, sleep
+
+
+def test_token_bucket_refills_at_its_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    assert bucket.wait_time(60) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now = 30
+    assert bucket.wait_time(30) == 0
+    assert bucket.wait_time(31) == pytest.approx(1.0)
+
+
+def test_token_bucket_caps_refill_and_oversized_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    clock.now = 600
+    bucket.refill()
+    assert bucket.tokens == 60
+    # A request larger than the bucket only waits for a full bucket
+    bucket.take(30)
+    assert bucket.wait_time(1000) == pytest.approx(30.0)
+
+
+def test_token_bucket_repays_overdrafts():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    bucket.take(90)
+    assert bucket.wait_time(1) == pytest.approx(31.0)
+
+
+def test_waiting_calls_are_served_by_priority_then_order():
+    scheduler, _ = make_scheduler(max_in_flight=1)
+    scheduler.acquire(1, 1)
+    order = []
+
+    def call(label, priority):
+        scheduler.acquire(priority, 1)
+        order.append(label)
+        scheduler.release()
+
+    threads = []
+    for label, priority in [('code 1', 1), ('code 2', 1), ('fix', 0)]:
+        thread = threading.Thread(target=call, args=(label, priority))
+        thread.start()
+        threads.append(thread)
+        # Queue the calls in a known order
+        deadline = time.monotonic() + 5
+        while scheduler.stats()['waiting'] < len(threads):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['fix', 'code 1', 'code 2']
+    assert scheduler.stats() == {'in_flight': 0, 'waiting': 0, 'retries': 0}
+
+
+def test_retries_transient_errors_with_bounded_backoff():
+    scheduler, sleep = make_scheduler(max_retries=5, backoff_base=1.0, backoff_max=4.0)
+    attempts = []
+
+    def func():
+        attempts.append(1)
+        if len(attempts) < 5:
+            raise RetryableLLMError("rate limited")
+        return "ok"
+
+    assert scheduler.call(func) == "ok"
+    assert len(sleep.delays) == 4
+    for attempt, delay in enumerate(sleep.delays):
+        assert 0 <= delay <= min(4.0, 2 ** attempt)
+    assert scheduler.stats()['retries'] == 4
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_backoff_honours_retry_after():
+    scheduler, sleep = make_scheduler(backoff_base=0.001)
+    errors = [RetryableLLMError("rate limited", retry_after=7.0)]
+
+    def func():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert scheduler.call(func) == "ok"
+    assert sleep.delays == [7.0]
+
+
+def test_gives_up_after_max_retries():
+    scheduler, sleep = make_scheduler(max_retries=2)
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise RetryableLLMError("overloaded")
+
+    with pytest.raises(RetryableLLMError):
+        scheduler.call(func)
+    assert len(calls) == 3
+    assert len(sleep.delays) == 2
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_other_errors_are_not_retried():
+    scheduler, sleep = make_scheduler()
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise ValueError("bad prompt")
+
+    with pytest.raises(ValueError):
+        scheduler.call(func)
+    assert len(calls) == 1
+    assert sleep.delays == []
+
+
+@pytest.fixture
+def fake_endpoint():
+    """Local JSON endpoint that answers 429 (Retry-After: 3) before every success"""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            requests.append(body)
+            if len(requests) % 2:
+                self.send_response(429)
+                self.send_header('Retry-After', '3')
+                self.end_headers()
+                return
+            payload = json.dumps({'text': f"{body['kind']}: {body['prompt']}"}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/generate", requests
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_client_retries_rate_limits_through_the_scheduler(fake_endpoint):
+    url, requests = fake_endpoint
+    scheduler, sleep = make_scheduler(backoff_base=0.001)
+    client = ScheduledLLMClient(HTTPLLMClient(url, timeout=5), scheduler)
+    assert client.generate("draw a circle", CODE, "circle") == "code: draw a circle"
+    assert client.generate("fix it", FIX) == "fix: fix it"
+    assert [request['kind'] for request in requests] == [CODE, CODE, FIX, FIX]
+    assert requests[0] == {'prompt': "draw a circle", 'kind': CODE, 'description': "circle"}
+    assert sleep.delays == [3.0, 3.0]
+    assert scheduler.stats()['retries'] == 2
+
+
+def test_http_backend_has_its_own_model_name(monkeypatch):
+    monkeypatch.setenv('LLM_BACKEND', 'http')
+    monkeypatch.setenv('LLM_ENDPOINT', 'http://127.0.0.1:9999/generate')
+    assert llm_model_name('gemini-2.5-flash') == 'http:http://127.0.0.1:9999/generate'
+    monkeypatch.setenv('LLM_BACKEND', 'gemini')
+    assert llm_model_name('gemini-2.5-flash') == 'gemini-2.5-flash'
@@ -0,0 +1,305 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUDirectory, list_files
+from metrics import run as run_measured
+
+# Every phrase is normalized to this raw format so phrases can be laid on
+# the timeline by byte offset and the voiceover is encoded only once
+SAMPLE_RATE = 24000
+BYTES_PER_SECOND = SAMPLE_RATE * 2  # 16-bit mono
+
+# Silence kept between a phrase that overran its slot and the next one
+PHRASE_GAP = 0.15
+
+# Words per minute espeak-ng speaks at rate 1.0 (its own default)
+ESPEAK_WPM = 175
+
+SEGMENT_PATTERN = re.compile(r'\[(\d+(?:\.\d+)?)s\s*-\s*(\d+(?:\.\d+)?)s\]:\s*')
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class TTSEngine:
+    """Interface every speech engine implements"""
+
+    name = "base"
+    # Whether synthesize() applies the speaking rate itself; otherwise the
+    # audio is time-stretched with ffmpeg afterwards
+    native_rate = False
+
+    def __init__(self, voice):
+        self.voice = voice
+
+    def synthesize(self, text, rate=1.0, report=None):
+        """Return encoded audio (any format ffmpeg can read) for the text"""
+        raise NotImplementedError
+
+
+class GTTSEngine(TTSEngine):
+    """Google Translate text-to-speech (needs network access); ``voice`` is the language"""
+
+    name = "gtts"
+
+    def __init__(self, voice="en"):
+        super().__init__(voice)
+
+    def synthesize(self, text, rate=1.0, report=None):
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.voice, slow=False).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class EspeakEngine(TTSEngine):
+    """Local espeak-ng synthesizer; ``voice`` is an espeak voice name such as en-us"""
+
+    name = "espeak"
+    native_rate = True
+
+    def __init__(self, voice="en-us"):
+        super().__init__(voice)
+        self.command = shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.command:
+            raise ValueError("espeak-ng is not installed")
+
+    def synthesize(self, text, rate=1.0, report=None):
+        result = run_measured('espeak', [
+            self.command, '--stdin', '--stdout',
+            '-v', self.voice,
+            '-s', str(int(ESPEAK_WPM * rate)),
+        ], input=text.encode('utf-8'), capture_output=True, check=True, report=report)
+        return result.stdout
+
+
+class PiperEngine(TTSEngine):
+    """Local piper neural synthesizer; ``voice`` is the path of a piper .onnx voice model"""
+
+    name = "piper"
+    native_rate = True
+
+    def __init__(self, voice):
+        super().__init__(voice)
+        self.command = shutil.which("piper")
+        if not self.command:
+            raise ValueError("piper is not installed")
+        if not voice or not os.path.exists(voice):
+            raise ValueError(f"Piper voice model not found: {voice}")
+
+    def synthesize(self, text, rate=1.0, report=None):
+        with tempfile.TemporaryDirectory(prefix="piper_") as tmp_dir:
+            output_file = os.path.join(tmp_dir, "phrase.wav")
+            run_measured('piper', [
+                self.command, '--model', self.voice,
+                '--length_scale', f'{1 / rate:.4f}',
+                '--output_file', output_file,
+            ], input=text.encode('utf-8'), capture_output=True, check=True, report=report)
+            with open(output_file, 'rb') as f:
+                return f.read()
+
+
+ENGINES = {
+    'gtts': (GTTSEngine, "en"),
+    'espeak': (EspeakEngine, "en-us"),
+    'piper': (PiperEngine, None),
+}
+
+
+def create_tts_engine(name=None, voice=None):
+    """Build the TTS engine selected through TTS_ENGINE / TTS_VOICE (gTTS by default)"""
+    name = name or os.getenv("TTS_ENGINE", "gtts")
+    if name not in ENGINES:
+        raise ValueError(f"Unknown TTS engine: {name}")
+    engine_class, default_voice = ENGINES[name]
+    return engine_class(voice or os.getenv("TTS_VOICE") or default_voice)
+
+
+def create_fallback_engine():
+    """Engine used for phrases the primary engine fails on (TTS_FALLBACK), or None"""
+    name = os.getenv("TTS_FALLBACK", "")
+    if not name:
+        return None
+    try:
+        return create_tts_engine(name, os.getenv("TTS_FALLBACK_VOICE"))
+    except ValueError as e:
+        print(f"TTS fallback disabled: {str(e)}")
+        return None
+
+
+class PhraseCache:
+    """On-disk cache of synthesized phrases as normalized raw PCM.
+
+    Keyed by engine, voice, rate and text; least recently used phrases are
+    evicted once the store goes over ``max_bytes``.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.store = LRUDirectory(max_bytes, self.files, os.remove)
+
+    def path_for(self, engine, text, rate):
+        payload = f"{engine.name}\0{engine.voice}\0{rate:.4f}\0{text}"
+        key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, key[:2], f"{key}.pcm")
+
+    def get(self, engine, text, rate):
+        path = self.path_for(engine, text, rate)
+        try:
+            with open(path, 'rb') as f:
+                pcm = f.read()
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return pcm
+
+    def put(self, engine, text, rate, pcm):
+        path = self.path_for(engine, text, rate)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(pcm)
+        os.replace(tmp_path, path)
+        self.store.added(len(pcm))
+
+    def files(self):
+        """List (last_use, size, path) for every cached phrase"""
+        return list_files(self.root, '.pcm')
+
+    def evict(self):
+        """Delete least recently used phrases until the cache fits its byte budget"""
+        self.store.evict()
+
+    def stats(self):
+        files, size = self.store.usage()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'files': files,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+def get_phrase_cache():
+    """Process-wide phrase cache, or None when TTS_CACHE_MAX_BYTES is 0"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            max_bytes = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+            if max_bytes <= 0:
+                return None
+            root = os.getenv("TTS_CACHE_DIR", os.path.join(
+                os.path.expanduser("~"), ".cache", "text2mathvideo", "tts"))
+            _cache = PhraseCache(root, max_bytes)
+        return _cache
+
+
+def parse_segments(explanation):
+    """Split a timed script into [(start_seconds, text)], in order.
+
+    Lines without a ``[a s-b s]:`` cue belong to the previous segment; a
+    script without any cues becomes one segment starting at zero.
+    """
+    segments = []
+    for line in explanation.splitlines():
+        line = re.sub(r'#.*', '', line)
+        match = SEGMENT_PATTERN.search(line)
+        if match:
+            segments.append([float(match.group(1)), line[match.end():]])
+        elif segments:
+            segments[-1][1] += ' ' + line
+        elif line.strip():
+            segments.append([0.0, line])
+    result = []
+    for start, text in segments:
+        text = ' '.join(SEGMENT_PATTERN.sub(' ', text).split())
+        if text:
+            result.append((start, text))
+    return result
+
+
+def to_pcm(audio, rate=1.0, report=None):
+    """Decode audio to the normalized raw format, time-stretching it by ``rate``"""
+    cmd = ['ffmpeg', '-hide_banner', '-i', 'pipe:0']
+    if rate != 1.0:
+        cmd += ['-filter:a', f'atempo={rate}']
+    cmd += ['-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1']
+    return run_measured('ffmpeg_tts_decode', cmd, input=audio, capture_output=True, check=True,
+                        report=report).stdout
+
+
+def synthesize_phrase(engine, text, rate=1.0, cache=None, fallback=None, report=None):
+    """Normalized PCM for one phrase, from the cache when possible"""
+    for current in [engine, fallback]:
+        if current is None:
+            continue
+        pcm = cache.get(current, text, rate) if cache else None
+        if pcm is not None:
+            return pcm
+        try:
+            if current.native_rate:
+                pcm = to_pcm(current.synthesize(text, rate, report), report=report)
+            else:
+                pcm = to_pcm(current.synthesize(text, 1.0, report), rate, report)
+        except Exception as e:
+            if current is fallback or fallback is None:
+                raise
+            print(f"{current.name} failed ({str(e)}), falling back to {fallback.name}")
+            continue
+        if cache:
+            cache.put(current, text, rate, pcm)
+        return pcm
+
+
+def synthesize_timeline(engine, segments, rate=1.0, cache=None, fallback=None, workers=4, report=None):
+    """Synthesize timed segments in parallel and lay them out on one track.
+
+    Each phrase starts at its cue time, or just after the previous phrase if
+    that one ran long. Returns (pcm, placements) where placements lists
+    (start, end, text) in seconds.
+    """
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(segments)), 1),
+                            thread_name_prefix="tts") as executor:
+        phrases = list(executor.map(
+            lambda segment: synthesize_phrase(engine, segment[1], rate, cache, fallback, report), segments))
+
+    track = bytearray()
+    placements = []
+    cursor = 0.0
+    for (start, text), pcm in zip(segments, phrases):
+        start = max(start, cursor)
+        offset = int(start * SAMPLE_RATE) * 2
+        track.extend(bytes(max(offset - len(track), 0)))
+        track.extend(pcm)
+        end = len(track) / BYTES_PER_SECOND
+        placements.append((round(start, 3), round(end, 3), text))
+        cursor = end + PHRASE_GAP
+    return bytes(track), placements
+
+
+def encode_mp3(pcm, report=None):
+    """Encode a normalized PCM track as MP3"""
+    return run_measured('ffmpeg_tts_encode', [
+        'ffmpeg', '-hide_banner',
+        '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-i', 'pipe:0',
+        '-f', 'mp3', 'pipe:1'
+    ], input=pcm, capture_output=True, check=True, report=report).stdout
@@ -0,0 +1,237 @@
+import ast
+import builtins
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from metrics import run as run_measured
+
+SCENE_CLASS = "ExplanationScene"
+
+# Mirrors Manim's default TexTemplate so LaTeX that compiles here compiles there
+LATEX_PREAMBLE = r"""\documentclass[preview]{standalone}
+\usepackage[english]{babel}
+\usepackage{amsmath}
+\usepackage{amssymb}
+\begin{document}
+"""
+
+# Run in a separate interpreter so the web and CLI processes never import Manim
+MANIM_NAMES_SCRIPT = (
+    "import json, manim; "
+    "print(json.dumps(sorted(getattr(manim, '__all__', None) or "
+    "[name for name in dir(manim) if not name.startswith('_')])))"
+)
+MANIM_NAMES_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "text2mathvideo")
+
+_manim_names = None
+_manim_names_lock = threading.Lock()
+
+
+class CodeValidationError(ValueError):
+    """Raised when generated Manim code fails static validation"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("Static validation failed:\n" + "\n".join(self.errors))
+
+
+def manim_version():
+    """Installed Manim version, read from package metadata without importing Manim"""
+    try:
+        from importlib.metadata import version
+        return version('manim')
+    except Exception:
+        return None
+
+
+def manim_names():
+    """Names exported by ``from manim import *``, or None if Manim is not importable"""
+    global _manim_names
+    with _manim_names_lock:
+        if _manim_names is None:
+            _manim_names = load_manim_names()
+    return _manim_names or None
+
+
+def load_manim_names():
+    """Read Manim's export list once per Manim version and keep it on disk"""
+    version = manim_version()
+    if version is None:
+        return set()
+    cache_file = os.path.join(MANIM_NAMES_CACHE_DIR, f"manim_names-{version}.json")
+    try:
+        with open(cache_file) as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    try:
+        result = run_measured('manim_names', [sys.executable, '-c', MANIM_NAMES_SCRIPT],
+                              capture_output=True, text=True, timeout=300, check=True)
+        names = json.loads(result.stdout.strip().splitlines()[-1])
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError) as e:
+        print(f"Could not read Manim's exported names: {str(e)}")
+        return set()
+    try:
+        os.makedirs(MANIM_NAMES_CACHE_DIR, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(names, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return set(names)
+
+
+def check_scene_class(tree):
+    """Make sure the module defines ExplanationScene(Scene) with a construct method"""
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == SCENE_CLASS:
+            bases = [getattr(base, 'id', None) or getattr(base, 'attr', '') for base in node.bases]
+            if not any(base.endswith('Scene') for base in bases):
+                return [f"line {node.lineno}: class {SCENE_CLASS} must inherit from Scene"]
+            methods = [item.name for item in node.body if isinstance(item, ast.FunctionDef)]
+            if 'construct' not in methods:
+                return [f"line {node.lineno}: class {SCENE_CLASS} has no construct(self) method"]
+            return []
+    return [f"no class named {SCENE_CLASS} found"]
+
+
+def bound_names(tree):
+    """Every name the module binds anywhere (deliberately flow-insensitive)"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name != '*':
+                    names.add((alias.asname or alias.name).split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+    return names
+
+
+def check_names(tree):
+    """Report names that are used but never defined, including unknown Manim symbols"""
+    errors = []
+    exported = manim_names()
+    star_import = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module == 'manim':
+            for alias in node.names:
+                if alias.name == '*':
+                    star_import = True
+                elif exported is not None and alias.name not in exported:
+                    errors.append(f"line {node.lineno}: manim has no symbol '{alias.name}'")
+
+    # Without the real export list we cannot tell Manim symbols from typos
+    if star_import and exported is None:
+        return errors
+
+    known = bound_names(tree) | set(dir(builtins))
+    if star_import:
+        known |= exported
+    reported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            if node.id not in known and node.id not in reported:
+                reported.add(node.id)
+                what = "unknown Manim symbol or undefined name" if star_import else "undefined name"
+                errors.append(f"line {node.lineno}: {what} '{node.id}'")
+    return errors
+
+
+def tex_strings(tree):
+    """Collect (line, class, source) for every MathTex/Tex call with literal arguments"""
+    found = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = node.func.id if isinstance(node.func, ast.Name) else getattr(node.func, 'attr', None)
+        if name not in ('MathTex', 'Tex'):
+            continue
+        parts = [arg.value for arg in node.args if isinstance(arg, ast.Constant) and isinstance(arg.value, str)]
+        # Skip calls built from variables or with a custom environment/template
+        if not parts or len(parts) != len(node.args):
+            continue
+        if any(kw.arg in ('tex_environment', 'tex_template') for kw in node.keywords):
+            continue
+        # Manim uses {{ }} to split a string into parts; the braces are not LaTeX
+        source = ' '.join(parts).replace('{{', '{').replace('}}', '}') if name == 'MathTex' else ' '.join(parts)
+        found.append((node.lineno, name, source))
+    return found
+
+
+def check_latex(tree, timeout=30):
+    """Compile every MathTex/Tex string in a single LaTeX pass"""
+    latex = shutil.which('latex')
+    expressions = tex_strings(tree)
+    if not latex or not expressions:
+        return []
+
+    lines = LATEX_PREAMBLE.splitlines()
+    spans = []
+    for lineno, name, source in expressions:
+        environment = 'align*' if name == 'MathTex' else 'center'
+        start = len(lines) + 1
+        lines.append(f"\\begin{{{environment}}}")
+        lines.extend(source.splitlines() or [''])
+        lines.append(f"\\end{{{environment}}}")
+        spans.append((start, len(lines), lineno, name, source))
+    lines.append(r"\end{document}")
+
+    with tempfile.TemporaryDirectory(prefix="texcheck_") as tmp_dir:
+        with open(os.path.join(tmp_dir, "check.tex"), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        try:
+            result = run_measured(
+                'latex', [latex, '-interaction=nonstopmode', '-halt-on-error', '-no-shell-escape', 'check.tex'],
+                cwd=tmp_dir, capture_output=True, text=True, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            return ["LaTeX check timed out"]
+        if result.returncode == 0:
+            return []
+        try:
+            with open(os.path.join(tmp_dir, "check.log"), errors='replace') as f:
+                log = f.read()
+        except OSError:
+            log = result.stdout
+
+    message = re.search(r'^! (.+)$', log, re.M)
+    message = message.group(1) if message else "LaTeX compilation failed"
+    where = re.search(r'^l\.(\d+)', log, re.M)
+    if where:
+        tex_line = int(where.group(1))
+        for start, end, lineno, name, source in spans:
+            if start <= tex_line <= end:
+                return [f"line {lineno}: LaTeX error in {name}({source!r}): {message}"]
+    return [f"LaTeX error: {message}"]
+
+
+def validate_manim_code(code, latex=True):
+    """Statically check generated Manim code and return a list of error messages"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return [f"line {e.lineno}: SyntaxError: {e.msg}"]
+
+    errors = check_scene_class(tree)
+    errors += check_names(tree)
+    # LaTeX is the slowest check, only worth running on otherwise sound code
+    if latex and not errors:
+        errors += check_latex(tree)
+    return errors
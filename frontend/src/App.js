@@ -1,11 +1,68 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import './App.css';
 
+const API_BASE = 'http://localhost:5500';
+const POLL_INTERVAL_MS = 2000;
+
+const STATUS_LABELS = {
+  queued: 'Waiting in queue...',
+  running: 'Generating...',
+};
+
 function App() {
   const [prompt, setPrompt] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
   const [videoUrl, setVideoUrl] = useState(null);
+  const [jobId, setJobId] = useState(null);
+  const [jobStatus, setJobStatus] = useState(null);
+  const pollTimer = useRef(null);
+
+  const stopPolling = () => {
+    if (pollTimer.current) {
+      clearTimeout(pollTimer.current);
+      pollTimer.current = null;
+    }
+  };
+
+  useEffect(() => stopPolling, []);
+
+  const finishJob = () => {
+    stopPolling();
+    setJobId(null);
+    setJobStatus(null);
+    setIsLoading(false);
+  };
+
+  const pollJob = async (id) => {
+    try {
+      const response = await fetch(`${API_BASE}/api/jobs/${id}`);
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.error || 'Failed to fetch job status');
+      }
+
+      setJobStatus(job.status);
+      if (job.status === 'succeeded') {
+        // The player streams the artifact URL with Range requests
+        setVideoUrl(`${API_BASE}${job.result_url}`);
+        finishJob();
+      } else if (job.status === 'failed') {
+        throw new Error(job.error || 'Failed to generate animation');
+      } else if (job.status === 'cancelled') {
+        finishJob();
+      } else {
+        // Progressive jobs show their preview until the final video is ready
+        if (job.preview_url) {
+          setVideoUrl(`${API_BASE}${job.preview_url}`);
+        }
+        pollTimer.current = setTimeout(() => pollJob(id), POLL_INTERVAL_MS);
+      }
+    } catch (err) {
+      setError(err.message);
+      finishJob();
+    }
+  };
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -19,7 +76,7 @@ function App() {
     setVideoUrl(null);
 
     try {
-      const response = await fetch('http://localhost:5500/api/generate', {
+      const response = await fetch(`${API_BASE}/api/jobs`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -27,18 +84,29 @@ function App() {
         body: JSON.stringify({ prompt }),
       });
 
+      const job = await response.json();
       if (!response.ok) {
-        const errorData = await response.json();
-        throw new Error(errorData.error || 'Failed to generate animation');
+        throw new Error(job.error || 'Failed to generate animation');
       }
 
-      const videoBlob = await response.blob();
-      const videoObjectUrl = URL.createObjectURL(videoBlob);
-      setVideoUrl(videoObjectUrl);
+      setJobId(job.job_id);
+      setJobStatus(job.status);
+      pollTimer.current = setTimeout(() => pollJob(job.job_id), POLL_INTERVAL_MS);
     } catch (err) {
       setError(err.message);
+      finishJob();
+    }
+  };
+
+  const handleCancel = async () => {
+    if (!jobId) {
+      return;
+    }
+    stopPolling();
+    try {
+      await fetch(`${API_BASE}/api/jobs/${jobId}`, { method: 'DELETE' });
     } finally {
-      setIsLoading(false);
+      finishJob();
     }
   };
 
@@ -64,16 +132,23 @@ function App() {
               disabled={isLoading}
             />
           </div>
-          <button type="submit" disabled={isLoading} className={isLoading ? 'loading' : ''}>
-            {isLoading ? (
-              <>
-                <span className="spinner"></span>
-                Generating...
-              </>
-            ) : (
-              'Create Animation'
+          <div className="form-actions">
+            <button type="submit" disabled={isLoading} className={isLoading ? 'loading' : ''}>
+              {isLoading ? (
+                <>
+                  <span className="spinner"></span>
+                  {STATUS_LABELS[jobStatus] || 'Generating...'}
+                </>
+              ) : (
+                'Create Animation'
+              )}
+            </button>
+            {jobId && (
+              <button type="button" onClick={handleCancel} className="cancel-button">
+                Cancel
+              </button>
             )}
-          </button>
+          </div>
           {error && <div className="error-message">{error}</div>}
         </form>
 
@@ -87,7 +162,7 @@ function App() {
               </video>
             </div>
             <a
-              href={videoUrl}
+              href={`${videoUrl}?download=1`}
               download="animation.mp4"
               className="download-button"
             >
@@ -108,4 +183,4 @@ function App() {
   );
 }
 
-export default App;
\ No newline at end of file
+export default App;